@@ -6,190 +6,383 @@ This is step 2 of the build process - run after download_images.py
 import argparse
 import gzip
 import hashlib
-import io
-import json
-import threading
+import os
+import pickle
+import sys
 import time
-import gc
+import ctypes
+from collections import deque
+from operator import attrgetter
+from dataclasses import dataclass, fields
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional, Union
 import numpy as np
+import orjson
+import ijson
 from tqdm import tqdm
 import faiss
 from multiprocessing import cpu_count
-from multiprocessing.pool import ThreadPool
-from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import requests
 import torch
+import torch.nn.functional as F
 import clip
-from PIL import Image, UnidentifiedImageError
+from PIL import Image
 
 # Import helpers
-import sys
 sys.path.insert(0, str(Path(__file__).parent))
-from helpers import validate_image, validate_args, safe_percentage
+from helpers import atomic_write, validate_image, validate_args, safe_percentage, load_image_arrays, limit_worker_threads
 from config import get_default_contrast
 
 
 # ------------------------- Shared Utilities -------------------------
 
-def get_bulk_download_uri(kind: str) -> str:
-    """kind in {"unique_artwork", "default_cards", "all_cards"}"""
+def get_bulk_info(kind: str) -> dict:
+    """Scryfall bulk-data entry (download_uri, updated_at, ...) for kind in {"unique_artwork", "default_cards", "all_cards"}"""
     r = requests.get("https://api.scryfall.com/bulk-data", timeout=30)
     r.raise_for_status()
     data = r.json()["data"]
     for item in data:
         if item["type"] == kind:
-            return item["download_uri"]
+            return item
     raise ValueError(f"Bulk type '{kind}' not found. Available: {[d['type'] for d in data]}")
 
-def load_bulk(kind: str) -> List[dict]:
-    url = get_bulk_download_uri(kind)
-    r = requests.get(url, stream=True, timeout=60)
-    r.raise_for_status()
-    raw = r.content
-    if url.endswith(".gz"):
-        raw = gzip.GzipFile(fileobj=io.BytesIO(raw)).read()
-    cards = json.loads(raw)
-    return cards
-
-def face_image_urls(card: dict):
-    out = []
-    def pick_card_image(uris):
-        # Prefer higher-res sources for better embedding accuracy.
-        # "normal" is a good balance; fall back to larger sizes if needed.
-        return uris.get("png") or uris.get("large") or uris.get("normal") or uris.get("small") or uris.get("border_crop")
-
+def get_bulk_download_uri(kind: str) -> str:
+    """kind in {"unique_artwork", "default_cards", "all_cards"}"""
+    return get_bulk_info(kind)["download_uri"]
+
+def load_bulk(kind: str, url: Optional[str] = None) -> Iterator[dict]:
+    """
+    Stream cards from a Scryfall bulk file one at a time.
+
+    The bulk JSON array is parsed incrementally as it downloads, so neither the
+    response body nor the full list of card dicts is ever held in memory.
+    """
+    url = url or get_bulk_download_uri(kind)
+    with requests.get(url, stream=True, timeout=60) as r:
+        r.raise_for_status()
+        r.raw.decode_content = True  # undo Content-Encoding: gzip transparently
+        raw = r.raw
+        if url.endswith(".gz"):
+            raw = gzip.GzipFile(fileobj=raw)
+        # use_float: numbers as float instead of Decimal, which orjson cannot serialize
+        yield from ijson.items(raw, "item", use_float=True)
+
+# Prefer higher-res sources for better embedding accuracy, falling back to smaller sizes.
+IMAGE_URI_PRIORITY = ("png", "large", "normal", "small", "border_crop")
+
+def _pick_card_image(uris: dict) -> Optional[str]:
+    for key in IMAGE_URI_PRIORITY:
+        url = uris.get(key)
+        if url:
+            return url
+    return None
+
+def face_image_urls(card: dict) -> Iterator[tuple]:
+    """Yield (name, image_url, card_url, face_id) for each face of a card that has an image."""
     if "image_uris" in card:
-        card_url = pick_card_image(card["image_uris"])
+        card_url = _pick_card_image(card["image_uris"])
         if card_url:
-            out.append((card["name"], card_url, card_url, card.get("id")))
+            yield (card["name"], card_url, card_url, card.get("id"))
 
-    for i, f in enumerate(card.get("card_faces", [])):
+    for i, f in enumerate(card.get("card_faces") or ()):
         if "image_uris" in f:
-            card_url = pick_card_image(f["image_uris"])
+            card_url = _pick_card_image(f["image_uris"])
             if card_url:
                 name = f.get("name") or card["name"]
-                face_id = (card.get("id") or "") + f":face:" + str(i)
-                out.append((name, card_url, card_url, face_id))
-    return out
+                face_id = (card.get("id") or "") + ":face:" + str(i)
+                yield (name, card_url, card_url, face_id)
+
+def _intern(value):
+    """sys.intern for optional strings; other values pass through."""
+    return sys.intern(value) if type(value) is str else value
+
+@dataclass(slots=True)
+class CardRecord:
+    """
+    Metadata for one image face.
+
+    Slotted instead of a dict per face; orjson serializes it as a JSON object
+    with keys in field order, so mtg_meta.jsonl is unchanged.
+    """
+    name: Optional[str]
+    scryfall_id: Optional[str]
+    face_id: Optional[str]
+    set: Optional[str]
+    collector_number: Optional[str]
+    frame: Optional[str]
+    layout: Optional[str]
+    lang: Optional[str]
+    colors: Optional[list]
+    image_url: str
+    card_url: str
+    scryfall_uri: Optional[str]
+
+def gather_records(cards, limit: Optional[int] = None) -> List[CardRecord]:
+    """Flatten bulk cards into one metadata record per image face, in bulk order."""
+    records: List[CardRecord] = []
+    # The parser allocates a fresh string per occurrence; set/frame/layout/lang/colors
+    # only take a few hundred distinct values, so share one object per value across
+    # all records instead of holding N copies
+    shared_colors: Dict[tuple, list] = {}
+    for c in cards:
+        colors = c.get("colors")
+        if colors is not None:
+            colors = shared_colors.setdefault(tuple(colors), colors)
+        card_set, frame, layout, lang = (
+            _intern(c.get("set")), _intern(c.get("frame")), _intern(c.get("layout")), _intern(c.get("lang"))
+        )
+        scryfall_id, collector_number, scryfall_uri = c.get("id"), c.get("collector_number"), c.get("scryfall_uri")
+        for name, card_img_url, display_url, face_id in face_image_urls(c):
+            records.append(CardRecord(
+                name, scryfall_id, face_id, card_set, collector_number, frame,
+                layout, lang, colors, card_img_url, display_url, scryfall_uri,
+            ))
+            # Stop as soon as the limit is reached instead of building and slicing the full list
+            if limit and len(records) >= limit:
+                return records
+    return records
+
+_record_values = attrgetter(*(f.name for f in fields(CardRecord)))
+# Bump when gather_records changes what it extracts from the bulk; cached
+# record lists from older versions are then rebuilt instead of reused
+BULK_CACHE_VERSION = 1
+
+def load_records(kind: str, limit: Optional[int] = None, bulk_cache: Optional[Path] = None) -> List[CardRecord]:
+    """
+    gather_records(load_bulk(kind), limit), cached on disk per Scryfall bulk version.
+
+    With bulk_cache, the full record list is pickled there under a key of the
+    bulk's updated_at, the CardRecord fields and BULK_CACHE_VERSION, so later
+    runs against the same bulk (e.g. the build step right after the download
+    step) skip the bulk download and JSON parse, while a changed record layout
+    never loads a stale cache.
+    Records are stored as plain tuples so the cache loads the same whether
+    this module runs as a script or is imported.
+    """
+    if bulk_cache is None:
+        return gather_records(load_bulk(kind), limit)
+
+    info = get_bulk_info(kind)
+    bulk_cache = Path(bulk_cache)
+    schema = ",".join(f.name for f in fields(CardRecord))
+    key = hashlib.sha1(f"{BULK_CACHE_VERSION}:{schema}:{kind}:{info['updated_at']}".encode("utf-8")).hexdigest()[:16]
+    cache_path = bulk_cache / f"{kind}_{key}.pkl"
+    try:
+        with open(cache_path, "rb") as f:
+            rows = pickle.load(f)
+        print(f"Using cached bulk records ({info['updated_at']}) from {cache_path}")
+        if limit:
+            rows = rows[:limit]
+        return [CardRecord(*row) for row in rows]
+    except (OSError, EOFError, pickle.UnpicklingError, TypeError):
+        pass  # not cached yet, or unreadable: parse the bulk
+
+    records = gather_records(load_bulk(kind, info["download_uri"]), limit)
+    # A limited run has only a prefix of the bulk; don't cache it as the full set
+    if not limit:
+        for stale in bulk_cache.glob(f"{kind}_*.pkl"):
+            stale.unlink(missing_ok=True)
+        atomic_write(cache_path, pickle.dumps([_record_values(r) for r in records], protocol=pickle.HIGHEST_PROTOCOL), fsync=False)
+    return records
 
 def safe_filename(url: str) -> str:
     # stable cache name independent of query params
     h = hashlib.sha1(url.encode("utf-8")).hexdigest()
-    ext = ".jpg"
-    if ".png" in url.lower():
-        ext = ".png"
+    # Only the path suffix matters (Scryfall URLs end in ".png?<timestamp>"),
+    # so look at the 4 characters before the query string instead of lowercasing the URL
+    path = url.partition("?")[0]
+    ext = ".png" if path[-4:] in (".png", ".PNG") else ".jpg"
     return f"{h}{ext}"
 
-def load_image_rgb(path: Path, target_size: int = 224, enhance_contrast: float = 1.0) -> Optional[Image.Image]:
-    try:
-        img = Image.open(path).convert("RGB")
-
-        # Enhance contrast if requested (helps with blurry cards)
-        if enhance_contrast > 1.0:
-            from PIL import ImageEnhance
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(enhance_contrast)
-
-        # Pad to square with black borders to preserve all card information
-        # (card name, mana cost, text box, P/T are important for detection)
-        w, h = img.size
-        s = max(w, h)
 
-        # Create black canvas and center the card
-        padded = Image.new("RGB", (s, s), (0, 0, 0))
-        paste_x = (s - w) // 2
-        paste_y = (s - h) // 2
-        padded.paste(img, (paste_x, paste_y))
-
-        # Resize to target size
-        if s != target_size:
-            padded = padded.resize((target_size, target_size), Image.BICUBIC)
-        return padded
-    except (UnidentifiedImageError, OSError):
-        return None
+# ------------------------- Embeddings -------------------------
 
+# Normalization constants used by CLIP's own preprocess (clip.clip._transform)
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
 
-# ------------------------- Embeddings -------------------------
 
 class Embedder:
-    def __init__(self, device: str = None):
+    def __init__(self, device: str = None, compile_model: bool = False):
         if torch.backends.mps.is_available():
           self.device = "mps"
         elif torch.cuda.is_available():
           self.device = "cuda"
+          # Batches have a fixed input shape, so let cuDNN benchmark and keep the
+          # fastest kernel for the patch-embedding convolution
+          torch.backends.cudnn.benchmark = True
         else:
           self.device = "cpu"
         self.model, self.preprocess = clip.load("ViT-B/32", device=self.device)  # 512-dim, 32px patch size - faster inference
-        self.lock = threading.Lock()  # CLIP is thread-safe with a lock for transform
         # Get embedding dimension from model (ViT-B/32 = 512)
         self.embedding_dim = self.model.visual.output_dim
-
-    def encode_images(self, pil_images: List[Image.Image]) -> np.ndarray:
-        tensors = []
-        with torch.no_grad():
-            for im in pil_images:
-                if im is None:
-                    tensors.append(None)
-                else:
-                    with self.lock:
-                        t = self.preprocess(im).unsqueeze(0)
-                    tensors.append(t)
-            batch = [t for t in tensors if t is not None]
-            if not batch:
-                return np.zeros((0, self.embedding_dim), dtype="float32")
-            x = torch.cat(batch, dim=0).to(self.device)
-            z = self.model.encode_image(x)
-            z = z / z.norm(dim=-1, keepdim=True)
-            arr = z.detach().cpu().numpy().astype("float32")
-        # Reinsert blanks for failed images
+        self.input_resolution = self.model.visual.input_resolution
+        self.mean = torch.tensor(CLIP_MEAN, device=self.device).view(1, 3, 1, 1)
+        self.std = torch.tensor(CLIP_STD, device=self.device).view(1, 3, 1, 1)
+        # Reused page-locked uint8 staging buffer for host->GPU copies (CUDA only)
+        self._host_batch: Optional[torch.Tensor] = None
+        # Batch size the compiled CUDA graph was captured for (set on first batch)
+        self._graph_batch: Optional[int] = None
+        self._pad_batches = compile_model and self.device == "cuda"
+        # clip.load already casts weights to fp16 on CUDA/MPS (fp32 on CPU), and
+        # encode_image casts its input to match, so no autocast is needed here.
+        if compile_model:
+            # Fuse the ViT blocks; "reduce-overhead" adds CUDA graphs on NVIDIA GPUs.
+            mode = "reduce-overhead" if self.device == "cuda" else "default"
+            self.model.visual = torch.compile(self.model.visual, mode=mode, fullgraph=False)
+
+    def _to_batch(self, arrays: List[np.ndarray]) -> torch.Tensor:
+        """
+        Turn square (H, W, 3) uint8 RGB arrays (as produced by load_image_array)
+        into a normalized (B, 3, R, R) tensor on the model device.
+
+        Equivalent to CLIP's preprocess for square inputs, but done once per batch:
+        the uint8 pixels are stacked on the CPU, copied to the device, and
+        resized/normalized there instead of per image through PIL.
+        """
+        if self.device == "cuda":
+            # Stack straight into a pinned buffer that is kept across batches:
+            # no per-batch host allocation, and the copy to the GPU is a DMA
+            n, (h, w, c) = len(arrays), arrays[0].shape
+            buf = self._host_batch
+            if buf is None or buf.shape[0] < n or buf.shape[1:] != (h, w, c):
+                buf = self._host_batch = torch.empty((n, h, w, c), dtype=torch.uint8, pin_memory=True)
+            np.stack(arrays, out=buf.numpy()[:n])
+            # Safe to reuse buf next batch: encode_images syncs on .cpu() before returning
+            x = buf[:n].to(self.device, non_blocking=True)
+        else:
+            arr = np.stack(arrays)  # (B, H, W, 3)
+            x = torch.from_numpy(arr).to(self.device)
+        x = x.permute(0, 3, 1, 2).float().div_(255.0)
+        r = self.input_resolution
+        if x.shape[-2:] != (r, r):
+            x = F.interpolate(x, size=(r, r), mode="bicubic", align_corners=False,
+                              antialias=self.device != "mps")
+        return x.sub_(self.mean).div_(self.std)
+
+    def encode_images(self, pil_images: List[Union[Image.Image, np.ndarray]]) -> np.ndarray:
+        """Embed PIL images or uint8 RGB arrays; None entries come back as zero rows."""
+        valid = [np.asarray(im, dtype=np.uint8) for im in pil_images if im is not None]
+        if not valid:
+            return np.zeros((0, self.embedding_dim), dtype="float32")
+        with torch.inference_mode():
+            if all(a.shape == valid[0].shape and a.shape[0] == a.shape[1] for a in valid):
+                x = self._to_batch(valid)
+            else:
+                # Mixed or non-square sizes: fall back to CLIP's per-image preprocess
+                x = torch.stack([self.preprocess(Image.fromarray(a)) for a in valid]).to(self.device)
+            n = x.shape[0]
+            if self._pad_batches:
+                # CUDA graphs are captured per input shape: pad short batches (the
+                # last one, or batches with failed decodes) up to the captured size
+                # so they replay the same graph instead of recompiling
+                if self._graph_batch is None:
+                    self._graph_batch = n
+                elif n < self._graph_batch:
+                    x = torch.cat([x, x.new_zeros((self._graph_batch - n, *x.shape[1:]))])
+            # Normalize in fp32: the fp16 output of CUDA/MPS models loses precision in the norm
+            z = F.normalize(self.model.encode_image(x)[:n].float(), dim=-1)
+            arr = z.cpu().numpy()
+        if len(valid) == len(pil_images):
+            return arr
+        # Reinsert blanks for failed images with one masked write
+        present = np.fromiter((im is not None for im in pil_images), dtype=bool, count=len(pil_images))
         out = np.zeros((len(pil_images), self.embedding_dim), dtype="float32")
-        j = 0
-        for i, t in enumerate(tensors):
-            if t is None:
-                continue
-            out[i] = arr[j]
-            j += 1
+        out[present] = arr
         return out
 
+    def encode_image(self, image: Union[Image.Image, np.ndarray]) -> np.ndarray:
+        """Embed a single PIL image or uint8 RGB array; returns a (D,) float32 vector."""
+        return self.encode_images([image])[0]
+
 
 # ------------------------- Build Process -------------------------
 
+def _release_free_heap() -> None:
+    """Return freed malloc arenas to the OS (glibc only; no-op elsewhere)."""
+    if not sys.platform.startswith("linux"):
+        return
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass  # not glibc (e.g. musl)
 
 
-def _validate_cache_worker(args):
-    """Worker function for parallel cache validation."""
-    rec, cache_dir = args
-    cache_file = cache_dir / safe_filename(rec["image_url"])
 
-    if not cache_file.exists() or cache_file.stat().st_size == 0:
-        return None, "missing", {
-            "file": cache_file.name,
-            "url": rec["image_url"],
-            "name": rec.get("name", "unknown"),
-            "scryfall_id": rec.get("scryfall_id", "unknown")
-        }
+def build_meta_sidecar(meta_path: Path, line_lengths: np.ndarray, cache_names: List[str]) -> None:
+    """
+    Write the lookup sidecars of mtg_meta.jsonl next to it.
 
-    is_valid, error = validate_image(cache_file)
-    if not is_valid:
-        return None, "invalid", {
-            "file": cache_file.name,
-            "reason": error,
-            "name": rec.get("name", "unknown")
-        }
+    mtg_meta.offsets.npy holds the byte offset of every JSONL line as int64
+    (line i is FAISS row i), so a reader can seek straight to one record
+    instead of parsing the whole file. mtg_meta.cache_rows.json maps each
+    image_cache file stem (SHA-1 of the image URL) to its row.
+    """
+    offsets = np.zeros(len(line_lengths), dtype=np.int64)
+    np.cumsum(line_lengths[:-1], out=offsets[1:])
+    np.save(meta_path.with_suffix(".offsets.npy"), offsets)
 
-    return cache_file, "valid", None
+    rows = {}
+    for row, name in enumerate(cache_names):
+        rows.setdefault(name.rpartition(".")[0], row)
+    meta_path.with_suffix(".cache_rows.json").write_bytes(orjson.dumps(rows))
 
 
-def _load_image_worker(args):
-    """Worker function for parallel image loading."""
-    idx, path, target_size, enhance_contrast = args
-    if path is None:
-        return idx, None
-    return idx, load_image_rgb(path, target_size=target_size, enhance_contrast=enhance_contrast)
+def build_hnsw_index(X: np.ndarray, hnsw_m: int, hnsw_ef_construction: int, quantize: str = "sq8") -> faiss.Index:
+    """Build an HNSW inner-product index over X on the CPU."""
+    d = X.shape[1]
+    print(f"Building HNSW index with M={hnsw_m}, efConstruction={hnsw_ef_construction}...")
+    if quantize == "sq8":
+        # 8-bit scalar quantizer: ~4x smaller index, per-dimension ranges learned from X
+        index = faiss.IndexHNSWSQ(d, faiss.ScalarQuantizer.QT_8bit, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.train(X)
+    elif quantize == "fp16":
+        # Half-precision storage: 2x smaller, no training, near-identical scores
+        index = faiss.IndexHNSWSQ(d, faiss.ScalarQuantizer.QT_fp16, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+    else:
+        index = faiss.IndexHNSWFlat(d, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = hnsw_ef_construction
+    # HNSW insertion is parallelized with OpenMP; set the thread count explicitly
+    # because container runtimes often report a misleading default to FAISS.
+    # Graph construction is memory-bandwidth bound, so threads past ~16 stop helping.
+    omp_threads = max(1, min(cpu_count(), 16))
+    faiss.omp_set_num_threads(omp_threads)
+    # Each add() is a parallel region with a barrier per HNSW level; ~1k vectors
+    # per thread per call keeps threads busy while still giving regular progress
+    add_chunk = 1024 * omp_threads
+    with tqdm(total=X.shape[0], desc="Building HNSW index", unit="vec") as pbar:
+        for start in range(0, X.shape[0], add_chunk):
+            end = start + add_chunk
+            index.add(X[start:end])
+            pbar.update(min(end, X.shape[0]) - start)
+    return index
+
+
+def build_ivf_index_gpu(X: np.ndarray) -> faiss.Index:
+    """
+    Train and fill an IVF-Flat inner-product index on the GPU, returned as a CPU index.
+
+    FAISS has no GPU HNSW builder, so this is the GPU path: k-means training
+    and list assignment run on CUDA, and the result is copied back so it can be
+    written and searched like the HNSW index. nprobe is stored in the index file.
+    """
+    n, d = X.shape
+    # ~4*sqrt(N) lists, with at least 39 training points per centroid (FAISS's minimum)
+    nlist = max(1, min(int(4 * np.sqrt(n)), n // 39))
+    print(f"Building IVF-Flat index on GPU with nlist={nlist}...")
+    res = faiss.StandardGpuResources()
+    gpu_index = faiss.GpuIndexIVFFlat(res, d, nlist, faiss.METRIC_INNER_PRODUCT)
+    X = np.ascontiguousarray(X)  # GPU upload needs a plain host array
+    gpu_index.train(X)
+    gpu_index.add(X)
+    index = faiss.index_gpu_to_cpu(gpu_index)
+    # Probe 1/8 of the lists: near-exact recall on CLIP vectors, still far fewer
+    # distance computations than a flat scan
+    index.nprobe = max(1, nlist // 8)
+    return index
 
 
 def build_embeddings_from_cache(
@@ -201,8 +394,14 @@ def build_embeddings_from_cache(
     target_size: int = 224,
     validate_cache: bool = True,
     hnsw_m: int = 32,
-    hnsw_ef_construction: int = 200,
-    enhance_contrast: float = 1.0
+    hnsw_ef_construction: int = 128,
+    enhance_contrast: float = 1.0,
+    compile_model: bool = False,
+    quantize: str = "sq8",
+    gpu_index: bool = False,
+    workers: Optional[int] = None,
+    preprocess_cache: Optional[Path] = None,
+    bulk_cache: Optional[Path] = None
 ):
     """Build FAISS index from already-cached images."""
     out_dir.mkdir(parents=True, exist_ok=True)
@@ -215,32 +414,18 @@ def build_embeddings_from_cache(
             f"Cache directory {cache_dir} does not exist.\n"
             f"Run download_images.py first to cache images."
         )
+    if preprocess_cache is not None:
+        preprocess_cache = Path(preprocess_cache)
+        preprocess_cache.mkdir(parents=True, exist_ok=True)
 
-    print(f"Loading Scryfall bulk '{kind}' for metadata...")
-    cards = load_bulk(kind)
-    print(f"Cards in bulk file: {len(cards):,}")
-
-    # Gather metadata (same as download step)
-    records: List[Dict] = []
-    for c in cards:
-        for name, card_img_url, display_url, face_id in face_image_urls(c):
-            records.append({
-                "name": name,
-                "scryfall_id": c.get("id"),
-                "face_id": face_id,
-                "set": c.get("set"),
-                "collector_number": c.get("collector_number"),
-                "frame": c.get("frame"),
-                "layout": c.get("layout"),
-                "lang": c.get("lang"),
-                "colors": c.get("colors"),
-                "image_url": card_img_url,
-                "card_url": display_url,
-                "scryfall_uri": c.get("scryfall_uri"),
-            })
+    # Fail before the (long) embedding pass rather than at index time
+    if gpu_index and (not hasattr(faiss, "StandardGpuResources") or faiss.get_num_gpus() == 0):
+        raise SystemExit("ERROR: --gpu-index needs faiss-gpu and a CUDA device (see environment-gpu.yml).")
 
+    print(f"Loading Scryfall bulk '{kind}' for metadata...")
+    # Gather metadata (same as download step) while the bulk file streams in
+    records = load_records(kind, limit, bulk_cache)
     if limit:
-        records = records[:limit]
         print(f"Limited to {limit} faces")
 
     print(f"Total faces to embed: {len(records):,}")
@@ -249,38 +434,68 @@ def build_embeddings_from_cache(
     if len(records) == 0:
         raise SystemExit("ERROR: No records to embed. Cannot create FAISS index from zero vectors.")
 
-    # Check which images are cached and validate them (parallel for M2 Max)
-    paths: List[Optional[Path]] = []
+    # Check which images are cached with one directory listing instead of a
+    # pathlib exists()/stat() pair per record; lookups are then plain dict hits.
+    # Only files that exist go on to the (expensive) decode check.
+    with os.scandir(cache_dir) as it:
+        cached_sizes = {e.name: e.stat().st_size for e in it if e.is_file()}
+    cache_names = [safe_filename(rec.image_url) for rec in records]
+    cache_files = [cache_dir / name for name in cache_names]
+    paths: List[Optional[Path]] = [None] * len(records)
     missing = 0
     missing_images = []
     validation_failed = 0
     validation_failures = []
+    to_validate: List[int] = []
 
-    # Use multiprocessing for parallel validation
-    num_workers = min(cpu_count(), 8)  # Cap at 8 to avoid overwhelming I/O
-    desc = "Validating cached images (parallel)" if validate_cache else "Checking image cache (parallel)"
-    print(f"Using {num_workers} parallel workers for cache validation")
-
-    with ThreadPool(num_workers) as pool:
-        validation_args = [(rec, cache_dir) for rec in records]
-        results = list(tqdm(
-            pool.imap(_validate_cache_worker, validation_args, chunksize=64),
-            total=len(records),
-            desc=desc
-        ))
-
-    # Process results
-    for cache_file, status, error_info in results:
-        if status == "missing":
-            paths.append(None)
+    for i, (rec, cache_file) in enumerate(zip(records, cache_files)):
+        if not cached_sizes.get(cache_names[i]):
             missing += 1
-            missing_images.append(error_info)
-        elif status == "invalid":
-            paths.append(None)
-            validation_failed += 1
-            validation_failures.append(error_info)
-        else:  # valid
-            paths.append(cache_file)
+            missing_images.append({
+                "file": cache_file.name,
+                "url": rec.image_url,
+                "name": rec.name or "unknown",
+                "scryfall_id": rec.scryfall_id or "unknown"
+            })
+        elif validate_cache:
+            to_validate.append(i)
+        else:
+            paths[i] = cache_file
+
+    # Validation and decode are CPU-bound; by default cap at 8 processes to avoid overwhelming I/O
+    num_workers = workers or max(1, min(8, cpu_count()))
+
+    # validate_image fully decodes each file, which is CPU-bound: use processes
+    validation_pool = None
+    if to_validate:
+        print(f"Using {num_workers} worker processes for cache validation")
+        validation_pool = ProcessPoolExecutor(max_workers=num_workers, initializer=limit_worker_threads)
+        # map() submits every task immediately, so the workers are started here,
+        # before the model-loading thread below exists
+        validation_results = validation_pool.map(
+            validate_image, [cache_files[i] for i in to_validate], chunksize=128
+        )
+
+    # Load CLIP in the background while the cache is validated; model init
+    # (weights from disk + device transfer) takes seconds and does not depend
+    # on which images survive validation, so the two stages can overlap.
+    print(f"Initializing CLIP model (in background)...")
+    model_loader = ThreadPoolExecutor(max_workers=1)
+    embedder_future = model_loader.submit(Embedder, compile_model=compile_model)
+
+    if validation_pool is not None:
+        results = tqdm(validation_results, total=len(to_validate), desc="Validating cached images (parallel)")
+        for i, (is_valid, error) in zip(to_validate, results):
+            if is_valid:
+                paths[i] = cache_files[i]
+            else:
+                validation_failed += 1
+                validation_failures.append({
+                    "file": cache_files[i].name,
+                    "reason": error,
+                    "name": records[i].name or "unknown"
+                })
+        validation_pool.shutdown()
 
     if missing > 0:
         print(f"⚠️  Warning: {missing} images not found in cache")
@@ -300,120 +515,167 @@ def build_embeddings_from_cache(
         if len(validation_failures) > 10:
             print(f"     ... and {len(validation_failures) - 10} more")
 
-    valid_count = len([p for p in paths if p is not None])
+    # Only images that passed the cache check get a row in the embedding buffer;
+    # valid_rows maps those compact rows back to positions in records
+    valid_rows = np.array([i for i, p in enumerate(paths) if p is not None], dtype=np.int64)
+    valid_count = len(valid_rows)
     if valid_count == 0:
         raise SystemExit("ERROR: No valid images to embed. Cannot create FAISS index from zero vectors.")
 
     # Load + embed with parallel image loading (M2 Max optimization)
-    print(f"Initializing CLIP model...")
-    embedder = Embedder()
+    print(f"Waiting for CLIP model...")
+    embedder = embedder_future.result()
+    model_loader.shutdown()
     embedding_dim = embedder.embedding_dim
-    vecs = np.zeros((len(records), embedding_dim), dtype="float32")
-    good = np.zeros((len(records),), dtype=bool)
+    # Accumulate embeddings in a file-backed .npy instead of RAM: rows are paged out
+    # as batches land, so all_cards builds don't hold N x 512 floats twice
+    raw_path = out_dir / "mtg_embeddings.raw.npy"
+    vecs = np.lib.format.open_memmap(raw_path, mode="w+", dtype="float32",
+                                     shape=(valid_count, embedding_dim))
+    good = np.zeros((valid_count,), dtype=bool)
 
     # Use moderate parallelism with batch-by-batch processing for best speed/memory balance
-    load_workers = max(1, min(4, cpu_count()))  # 4 workers is the sweet spot
-    print(f"Using {load_workers} workers, processing {batch_size} images per batch")
+    # Decode + contrast + pad + resize is CPU-bound and Pillow only releases the GIL
+    # for parts of it, so use processes. Workers return uint8 arrays, which pickle
+    # as one buffer and feed straight into Embedder's batched preprocess.
+    load_workers = num_workers
+    print(f"Using {load_workers} decode processes, processing {batch_size} images per batch")
 
     prefetch_batches = 2
     prefetch_limit = max(load_workers, min(valid_count, batch_size * prefetch_batches))
-    embed_batches = 0
+    # Each worker task decodes a run of consecutive images, so pickling and
+    # future bookkeeping are paid per chunk rather than per image
+    load_chunk = max(1, min(32, valid_count // load_workers))
+    max_inflight = max(load_workers, -(-prefetch_limit // load_chunk))
     batch_imgs: List = []
     batch_idx: List[int] = []
 
-    with ThreadPoolExecutor(max_workers=load_workers) as executor:
-        path_iter = iter(enumerate(paths))
-        pending = {}
-
-        with tqdm(total=len(paths), desc="Embedding images", unit="img") as pbar:
-            def refill_pending():
-                while len(pending) < prefetch_limit:
-                    try:
-                        idx, path = next(path_iter)
-                    except StopIteration:
+    with ProcessPoolExecutor(max_workers=load_workers, initializer=limit_worker_threads) as executor:
+        valid_paths = [paths[i] for i in valid_rows]
+        chunk_starts = iter(range(0, valid_count, load_chunk))
+        # FIFO of (first_row, future): completion order doesn't matter because
+        # batch_idx carries the buffer row, and popping the oldest future keeps
+        # the bookkeeping O(1) per chunk instead of re-scanning a pending set
+        inflight = deque()
+
+        with tqdm(total=valid_count, desc="Embedding images", unit="img") as pbar:
+            def refill_inflight():
+                while len(inflight) < max_inflight:
+                    start = next(chunk_starts, None)
+                    if start is None:
                         break
-                    if path is None:
-                        pbar.update(1)
-                        continue
-                    future = executor.submit(_load_image_worker, (idx, path, target_size, enhance_contrast))
-                    pending[future] = None
+                    chunk = valid_paths[start:start + load_chunk]
+                    inflight.append((start, executor.submit(load_image_arrays, chunk, target_size, enhance_contrast, preprocess_cache)))
+
+            refill_inflight()
 
-            refill_pending()
+            while inflight:
+                start, fut = inflight.popleft()
+                imgs = fut.result()
+                # Top the queue back up before (possibly) embedding, so workers stay busy meanwhile
+                refill_inflight()
+                pbar.update(len(imgs))
 
-            while pending:
-                done, _ = wait(list(pending.keys()), return_when=FIRST_COMPLETED)
-                for fut in done:
-                    idx, img = fut.result()
-                    del pending[fut]
-                    if img is not None:
-                        batch_idx.append(idx)
-                        batch_imgs.append(img)
-                    pbar.update(1)
+                for idx, img in enumerate(imgs, start):
+                    if img is None:
+                        continue
+                    batch_idx.append(idx)
+                    batch_imgs.append(img)
 
                     if len(batch_idx) == batch_size:
                         Z = embedder.encode_images(batch_imgs)
-                        for local, global_i in enumerate(batch_idx):
-                            if local < Z.shape[0]:
-                                vecs[global_i] = Z[local]
-                                good[global_i] = True
+                        rows = np.asarray(batch_idx, dtype=np.int64)
+                        vecs[rows] = Z
+                        good[rows] = True
                         del Z
                         batch_imgs.clear()
                         batch_idx.clear()
-                        embed_batches += 1
-                        if embed_batches % 10 == 0:
-                            gc.collect()
-
-                refill_pending()
 
     if batch_imgs:
+        # Failed loads never enter batch_imgs, so Z has exactly one row per batch_idx entry
         Z = embedder.encode_images(batch_imgs)
-        for local, global_i in enumerate(batch_idx):
-            if local < Z.shape[0]:
-                vecs[global_i] = Z[local]
-                good[global_i] = True
-
-    kept = np.where(good)[0]
-    X = vecs[kept]
-    meta = [records[i] for i in kept]
-    print(f"Embedded {X.shape[0]:,} / {len(records):,} faces")
-
-    # Verify vector normalization before indexing
-    if X.shape[0] > 0:
-        norms = np.linalg.norm(X, axis=1)
-        zero_mask = norms == 0
-        zero_count = int(np.sum(zero_mask))
-        if zero_count > 0:
-            print(f"WARNING: {zero_count} zero-norm vectors found. Forcing norm to 1.0 to avoid division by zero.")
-            norms = norms.copy()
-            norms[zero_mask] = 1.0
-        if not np.allclose(norms, 1.0, atol=1e-5):
-            print(f"WARNING: Vectors not properly normalized. Norms range: [{norms.min():.6f}, {norms.max():.6f}]")
-            print("Normalizing vectors now...")
-            X = X / norms[:, np.newaxis]
-        else:
-            print(f"✓ Vector normalization verified (norms within 1.0 ± 1e-5)")
-
-    # Save embeddings for browser export / fallback searchers
-    np.save(out_dir / "mtg_embeddings.npy", X)
-    print(f"Saved raw embeddings to {out_dir/'mtg_embeddings.npy'}")
+        rows = np.asarray(batch_idx, dtype=np.int64)
+        vecs[rows] = Z
+        good[rows] = True
+
+    # Rows whose image failed to decode are dropped; kept indexes records
+    all_good = bool(good.all())
+    kept = valid_rows if all_good else valid_rows[good]
+    if len(kept) == 0:
+        raise SystemExit("ERROR: No cached image could be decoded. Cannot create FAISS index from zero vectors.")
+    total_records = len(records)
+
+    # Save metadata line-by-line (easy to stream later), straight from the kept
+    # records rather than materializing a second filtered list
+    meta_path = out_dir / "mtg_meta.jsonl"
 
-    # Build FAISS index with HNSW for speed (vectors already L2-normalized)
-    # Use METRIC_INNER_PRODUCT for cosine similarity with normalized vectors
-    d = X.shape[1]
-    print(f"Building HNSW index with M={hnsw_m}, efConstruction={hnsw_ef_construction}...")
-    hnsw_index = faiss.IndexHNSWFlat(d, hnsw_m, faiss.METRIC_INNER_PRODUCT)
-    hnsw_index.hnsw.efConstruction = hnsw_ef_construction
-    index = faiss.IndexIDMap(hnsw_index)
-    index.add_with_ids(X, np.arange(X.shape[0]).astype("int64"))
+    def write_meta(cache_names):
+        line_lengths = np.empty(len(kept), dtype=np.int64)
+
+        def lines():
+            for j, i in enumerate(kept):
+                line = orjson.dumps(records[i]) + b"\n"
+                line_lengths[j] = len(line)
+                yield line
+
+        # orjson serializes to UTF-8 bytes in C (non-ASCII passes through, like ensure_ascii=False)
+        # 1 MiB buffer: one write() syscall per few thousand records instead of per 8 KiB
+        with open(meta_path, "wb", buffering=1 << 20) as f:
+            f.writelines(lines())
+        build_meta_sidecar(meta_path, line_lengths, [cache_names[i] for i in kept])
+
+    # Serialize the metadata on a second thread while the embeddings are copied,
+    # normalized and flushed below; those NumPy/FAISS calls release the GIL
+    writer = ThreadPoolExecutor(max_workers=1)
+    meta_future = writer.submit(write_meta, cache_names)
+
+    # Fill the final .npy in place through a memory map instead of building X in
+    # RAM and np.save-ing it: the kept rows are copied once, page by page, and
+    # the pages stay file-backed (evictable) through the index build
+    emb_path = out_dir / "mtg_embeddings.npy"
+    X = np.lib.format.open_memmap(emb_path, mode="w+", dtype="float32",
+                                  shape=(len(kept), embedding_dim))
+    if all_good:
+        X[:] = vecs  # usually every row decoded: one straight copy, no mask scan
+    else:
+        np.compress(good, vecs, axis=0, out=X)
+    del vecs
+    raw_path.unlink()
+    # The model, pixel buffers and path lists are not needed past this point
+    # (valid_paths is rebound, not deleted: refill_inflight closes over it)
+    del embedder, batch_imgs, paths, cache_files, cache_names
+    valid_paths = None
+    print(f"Embedded {X.shape[0]:,} / {total_records:,} faces")
+
+    # Re-normalize unconditionally: one in-place SIMD pass is cheaper than
+    # measuring the norms first, and it removes fp16 drift from the device.
+    # X is C-contiguous float32 as FAISS expects, so nothing is copied.
+    faiss.normalize_L2(X)
+    X.flush()
+    print(f"Saved raw embeddings to {emb_path}")
+
+    meta_future.result()
+    writer.shutdown()
+    print(f"Saved metadata for {len(kept)} vectors to {meta_path}")
+
+    # The records are not needed for the index build (only counts are reported
+    # from here on). Free them and hand glibc's retained heap (decode buffers,
+    # per-batch tensors) back to the OS before the HNSW graph is allocated.
+    # Rebound rather than deleted: write_meta closes over records.
+    records = None
+    _release_free_heap()
+
+    # Vectors are already L2-normalized: METRIC_INNER_PRODUCT gives cosine similarity.
+    # No IndexIDMap: FAISS ids are the implicit insertion order, which already
+    # matches the line order of mtg_meta.jsonl and the rows of mtg_embeddings.npy
+    if gpu_index:
+        index = build_ivf_index_gpu(X)
+        index_desc = f"IVF-Flat index (nlist={index.nlist}, nprobe={index.nprobe}, METRIC_INNER_PRODUCT)"
+    else:
+        index = build_hnsw_index(X, hnsw_m, hnsw_ef_construction, quantize)
+        index_desc = f"HNSW index (M={hnsw_m}, efConstruction={hnsw_ef_construction}, quantize={quantize}, METRIC_INNER_PRODUCT)"
     faiss.write_index(index, str(out_dir / "mtg_cards.faiss"))
-    print(f"Saved HNSW index (M={hnsw_m}, efConstruction={hnsw_ef_construction}, METRIC_INNER_PRODUCT) to {out_dir/'mtg_cards.faiss'}")
-
-    # Save metadata line-by-line (easy to stream later)
-    meta_path = out_dir / "mtg_meta.jsonl"
-    with open(meta_path, "w", encoding="utf-8") as f:
-        for m in meta:
-            f.write(json.dumps(m, ensure_ascii=False) + "\n")
-    print(f"Saved metadata for {len(meta)} vectors to {meta_path}")
+    print(f"Saved {index_desc} to {out_dir/'mtg_cards.faiss'}")
 
     # Generate build manifest
     build_duration = time.time() - build_start_time
@@ -428,42 +690,47 @@ def build_embeddings_from_cache(
             "hnsw_m": hnsw_m,
             "hnsw_ef_construction": hnsw_ef_construction,
             "validate_cache": validate_cache,
-            "enhance_contrast": enhance_contrast
+            "enhance_contrast": enhance_contrast,
+            "compile_model": compile_model,
+            "quantize": quantize,
+            "gpu_index": gpu_index,
+            "preprocess_cache": preprocess_cache is not None
         },
         "statistics": {
-            "total_records": len(records),
+            "total_records": total_records,
             "missing_from_cache": missing,
             "validation_failures": validation_failed if validate_cache else 0,
             "successfully_embedded": X.shape[0],
-            "failed_or_missing": len(records) - X.shape[0],
-            "success_rate_percent": round((X.shape[0] / len(records)) * 100, 2) if len(records) > 0 else 0
+            "failed_or_missing": total_records - X.shape[0],
+            "success_rate_percent": round((X.shape[0] / total_records) * 100, 2) if total_records > 0 else 0
         },
         "outputs": {
             "embeddings": "mtg_embeddings.npy",
             "faiss_index": "mtg_cards.faiss",
-            "metadata": "mtg_meta.jsonl"
+            "metadata": "mtg_meta.jsonl",
+            "metadata_offsets": "mtg_meta.offsets.npy",
+            "cache_rows": "mtg_meta.cache_rows.json"
         }
     }
 
     manifest_path = out_dir / "build_manifest.json"
-    with open(manifest_path, "w") as f:
-        json.dump(manifest, f, indent=2)
+    manifest_path.write_bytes(orjson.dumps(manifest, option=orjson.OPT_INDENT_2))
     print(f"Saved build manifest to {manifest_path}")
 
     print(f"\n=== Build Summary ===")
-    print(f"Total records: {len(records):,}")
+    print(f"Total records: {total_records:,}")
     print(f"Missing from cache: {missing:,}")
     if validate_cache:
         print(f"Validation failures: {validation_failed:,}")
     print(f"Successfully embedded: {X.shape[0]:,}")
-    print(f"Failed/missing: {len(records) - X.shape[0]:,} ({safe_percentage(len(records) - X.shape[0], len(records))})")
-    print(f"Success rate: {safe_percentage(X.shape[0], len(records))}")
-    if 'zero_count' in locals() and zero_count > 0:
-        print(f"Zero-norm vectors: {zero_count:,}")
+    print(f"Failed/missing: {total_records - X.shape[0]:,} ({safe_percentage(total_records - X.shape[0], total_records)})")
+    print(f"Success rate: {safe_percentage(X.shape[0], total_records)}")
     print(f"\nOutput directory: {out_dir}")
     print(f"  - mtg_embeddings.npy: {X.shape[0]:,} vectors")
-    print(f"  - mtg_cards.faiss: HNSW index")
+    print(f"  - mtg_cards.faiss: {'IVF-Flat' if gpu_index else 'HNSW'} index")
     print(f"  - mtg_meta.jsonl: metadata")
+    print(f"  - mtg_meta.offsets.npy: byte offset of each metadata line")
+    print(f"  - mtg_meta.cache_rows.json: image_cache file -> index row")
     print(f"\nNext step: Run export_for_browser.py to create browser assets")
 
 
@@ -490,10 +757,24 @@ def main():
                     help="Skip image validation (faster but may include corrupted images).")
     ap.add_argument("--hnsw-m", type=int, default=32,
                     help="HNSW M parameter (connectivity, default: 32). Higher = better recall, slower build.")
-    ap.add_argument("--hnsw-ef-construction", type=int, default=200,
-                    help="HNSW efConstruction parameter (build accuracy, default: 200). Higher = better quality, slower build.")
+    ap.add_argument("--hnsw-ef-construction", type=int, default=128,
+                    help="HNSW efConstruction parameter (build accuracy, default: 128). Higher = better quality, slower build; recall gains flatten out past ~128.")
     ap.add_argument("--contrast", type=float, default=get_default_contrast(),
                     help="Contrast enhancement factor (default: 1.5 recommended for blurry cards). Use 1.0 for no enhancement, 1.2 for 20%% boost.")
+    ap.add_argument("--compile", dest="compile_model", action="store_true", default=False,
+                    help="torch.compile the CLIP vision tower (slower startup, faster embedding on large builds).")
+    ap.add_argument("--quantize", choices=["none", "fp16", "sq8"], default="sq8",
+                    help="FAISS index storage: sq8 (8-bit scalar quantizer, ~4x smaller, default), fp16 (~2x smaller) or none (float32). mtg_embeddings.npy stays float32.")
+    ap.add_argument("--gpu-index", dest="gpu_index", action="store_true", default=False,
+                    help="Build an IVF-Flat index on the GPU instead of HNSW on the CPU (needs faiss-gpu; ignores --hnsw-* and --quantize).")
+    ap.add_argument("--preprocess-cache", type=Path, default=None,
+                    help="Directory to keep preprocessed images (uint8 .npz per card and --size/--contrast, refreshed when the source file or decoder changes) so rebuilds skip image decode. Off by default.")
+    ap.add_argument("--workers", type=int, default=None,
+                    help="Processes for cache validation and image decode (default: CPU count, capped at 8). Raise on many-core machines if the device is waiting on decode.")
+    ap.add_argument("--bulk-cache", type=Path, default=Path("bulk_cache"),
+                    help="Directory to cache parsed Scryfall bulk metadata, reused until Scryfall publishes a new bulk (default: bulk_cache).")
+    ap.add_argument("--no-bulk-cache", dest="bulk_cache", action="store_const", const=None,
+                    help="Always download and parse the Scryfall bulk file.")
     args = ap.parse_args()
 
     # Validate CLI arguments
@@ -509,7 +790,13 @@ def main():
         validate_cache=args.validate_cache,
         hnsw_m=args.hnsw_m,
         hnsw_ef_construction=args.hnsw_ef_construction,
-        enhance_contrast=args.contrast
+        enhance_contrast=args.contrast,
+        compile_model=args.compile_model,
+        quantize=args.quantize,
+        gpu_index=args.gpu_index,
+        workers=args.workers,
+        preprocess_cache=args.preprocess_cache,
+        bulk_cache=args.bulk_cache
     )
 
 
@@ -12,9 +12,12 @@ Environment variables required:
     BLOB_READ_WRITE_TOKEN: Authentication token for Vercel Blob
 """
 import argparse
-import json
+import io
 import os
 import subprocess
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import Optional
@@ -22,12 +25,22 @@ import sys
 
 try:
     import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
 except ImportError:
     print("Error: 'requests' library not found. Install with: pip install requests")
     sys.exit(1)
 
 from config import get_config
 
+# Uploads are network-bound; a few in flight hide per-request latency
+UPLOAD_WORKERS = 4
+# Rate limits and transient server errors are retried with a fresh body
+UPLOAD_RETRIES = 3
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# Part Content-Type by file extension (same table as scripts/deploy_to_blob.mjs)
+CONTENT_TYPES = {'.json': 'application/json'}
+
 
 def get_blob_credentials() -> tuple[str, str, str]:
     """Get Vercel Blob credentials from environment."""
@@ -54,11 +67,73 @@ def get_blob_credentials() -> tuple[str, str, str]:
     return blob_url, upload_url, blob_token
 
 
+class MultipartFileBody:
+    """
+    Streaming multipart/form-data body holding a single file field.
+
+    requests reads it like a file, in small chunks, while sending; len()
+    gives the exact Content-Length, so the upload is neither buffered in
+    memory nor sent with chunked transfer encoding.
+    """
+
+    def __init__(self, f, filename: str, field: str = "file"):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        head = (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: {CONTENT_TYPES.get(Path(filename).suffix, "application/octet-stream")}\r\n\r\n'
+        ).encode("utf-8")
+        tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        self._length = len(head) + os.fstat(f.fileno()).st_size + len(tail)
+        self._parts = [io.BytesIO(head), f, io.BytesIO(tail)]
+
+    def __len__(self) -> int:
+        return self._length
+
+    def read(self, size: int = -1) -> bytes:
+        out = b""
+        while self._parts and (size < 0 or len(out) < size):
+            chunk = self._parts[0].read(-1 if size < 0 else size - len(out))
+            if chunk:
+                out += chunk
+            else:
+                self._parts.pop(0)
+        return out
+
+
+def create_upload_session(blob_token: Optional[str] = None) -> requests.Session:
+    """
+    Create the session shared by all upload workers.
+
+    With blob_token, the Authorization header is set once on the session
+    instead of being rebuilt for every request.
+
+    The connection pool holds one keep-alive connection per worker, so each
+    worker pays the TLS handshake once. Failed connection attempts are
+    retried here, because no body has been sent yet. Error responses are
+    retried in upload_file_to_blob, since the streamed body has to be
+    reopened for each attempt.
+    """
+    session = requests.Session()
+    if blob_token:
+        session.headers['Authorization'] = f'Bearer {blob_token}'
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=UPLOAD_WORKERS,
+        max_retries=Retry(total=3, connect=3, read=0, status=0, backoff_factor=0.5)
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
 def upload_file_to_blob(
     file_path: Path,
     upload_url: str,
     blob_token: str,
-    remote_path: str
+    remote_path: str,
+    session: Optional[requests.Session] = None
 ) -> bool:
     """
     Upload a single file to Vercel Blob Storage.
@@ -68,6 +143,7 @@ def upload_file_to_blob(
         blob_url: Base Vercel Blob URL
         blob_token: Authentication token
         remote_path: Remote path in blob storage (e.g., "v2026-01-20-ab12cd3/embeddings.f32bin")
+        session: Optional shared session (keeps connections alive across uploads)
 
     Returns:
         True if successful, False otherwise
@@ -80,25 +156,34 @@ def upload_file_to_blob(
     print(f"📤 Uploading {file_path.name} ({file_size_mb:.1f} MB) → {remote_path}")
 
     try:
-        with open(file_path, 'rb') as f:
-            files = {'file': (remote_path, f)}
-            headers = {'Authorization': f'Bearer {blob_token}'}
-
-            # Vercel Blob API endpoint
-            response = requests.post(
-                f"{upload_url.rstrip('/')}/upload",
-                files=files,
-                headers=headers,
-                timeout=300  # 5 minute timeout for large files
-            )
+        for attempt in range(UPLOAD_RETRIES + 1):
+            with open(file_path, 'rb') as f:
+                # Stream the file from disk instead of letting requests build the
+                # whole multipart body in memory
+                body = MultipartFileBody(f, remote_path)
+                headers = {'Content-Type': body.content_type}
+                if session is None or 'Authorization' not in session.headers:
+                    headers['Authorization'] = f'Bearer {blob_token}'
+
+                # Vercel Blob API endpoint
+                response = (session or requests).post(
+                    f"{upload_url.rstrip('/')}/upload",
+                    data=body,
+                    headers=headers,
+                    timeout=300  # 5 minute timeout for large files
+                )
 
             if response.status_code in [200, 201]:
                 print(f"✓ Uploaded: {remote_path}")
                 return True
-            else:
-                print(f"❌ Upload failed: {response.status_code}")
-                print(f"   Response: {response.text}")
-                return False
+            if response.status_code in RETRY_STATUS and attempt < UPLOAD_RETRIES:
+                delay = 2 ** attempt
+                print(f"⚠️  {response.status_code} for {remote_path}, retrying in {delay}s")
+                time.sleep(delay)
+                continue
+            print(f"❌ Upload failed: {response.status_code}")
+            print(f"   Response: {response.text}")
+            return False
 
     except requests.exceptions.Timeout:
         print(f"❌ Upload timeout for {file_path.name}")
@@ -173,6 +258,7 @@ def deploy_embeddings(
     # Files to upload
     base_files = [
         "embeddings.f32bin",
+        "embeddings.f16bin",
         "embeddings.i8bin",
         "meta.json",
         "build_manifest.json",
@@ -202,10 +288,11 @@ def deploy_embeddings(
 
     # Upload files
     print(f"\n⏳ Uploading {len(existing_files)} file(s)...")
-    results = []
-    for src, dst in existing_files:
-        success = upload_file_to_blob(src, upload_url, blob_token, dst)
-        results.append(success)
+    with create_upload_session(blob_token) as session, ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        results = list(executor.map(
+            lambda pair: upload_file_to_blob(pair[0], upload_url, blob_token, pair[1], session),
+            existing_files
+        ))
 
     # Summary
     successful = sum(results)
@@ -4,21 +4,20 @@ Download and cache MTG card images from Scryfall.
 This is step 1 of the build process - run before build_embeddings.py
 """
 import argparse
+import os
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import Optional
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 # Import helpers from build script
 import sys
 sys.path.insert(0, str(Path(__file__).parent))
 from build_embeddings import (
-    get_bulk_download_uri,
-    load_bulk,
-    face_image_urls,
+    load_records,
     safe_filename
 )
-from helpers import DownloadSession, atomic_write_stream, validate_args, safe_percentage
+from helpers import DownloadSession, atomic_write_stream, batched_atomic_writes, validate_args, safe_percentage
 
 
 def download_single_image(
@@ -48,14 +47,18 @@ def download_single_image(
         fp.unlink()
     
     try:
-        response = session.get(url, stream=True)
-        response.raise_for_status()
-        
-        # Write atomically to prevent partial files
-        if atomic_write_stream(fp, response.iter_content(16384)):
-            return (fp, None)
-        else:
-            return (None, "Failed to write file")
+        # Context manager returns the connection to the pool even when the
+        # status check or the write fails part-way through the body
+        with session.get(url, stream=True) as response:
+            response.raise_for_status()
+            
+            # Write atomically to prevent partial files. No per-file fsync:
+            # the cache is re-creatable, and empty files are re-downloaded.
+            # The pages stay cached: the embedding step reads these files next
+            if atomic_write_stream(fp, response.iter_content(1 << 20), fsync=False):
+                return (fp, None)
+            else:
+                return (None, "Failed to write file")
     
     except Exception as e:
         return (None, str(e))
@@ -68,36 +71,16 @@ def download_all_images(
     workers: int = 16,
     timeout_connect: int = 5,
     timeout_read: int = 30,
-    max_retries: int = 5
+    max_retries: int = 5,
+    bulk_cache: Optional[Path] = None
 ):
     """Download all card images with parallel workers and retry logic."""
     cache_dir.mkdir(parents=True, exist_ok=True)
     
     print(f"Loading Scryfall bulk '{kind}' ...")
-    cards = load_bulk(kind)
-    print(f"Cards in bulk file: {len(cards):,}")
-    
-    # Gather metadata
-    records: List[Dict] = []
-    for c in cards:
-        for name, card_img_url, display_url, face_id in face_image_urls(c):
-            records.append({
-                "name": name,
-                "scryfall_id": c.get("id"),
-                "face_id": face_id,
-                "set": c.get("set"),
-                "collector_number": c.get("collector_number"),
-                "frame": c.get("frame"),
-                "layout": c.get("layout"),
-                "lang": c.get("lang"),
-                "colors": c.get("colors"),
-                "image_url": card_img_url,
-                "card_url": display_url,
-                "scryfall_uri": c.get("scryfall_uri"),
-            })
-    
+    # Gather metadata while the bulk file streams in
+    records = load_records(kind, limit, bulk_cache)
     if limit:
-        records = records[:limit]
         print(f"Limited to {limit} faces")
     
     print(f"Total faces to download: {len(records):,}")
@@ -107,46 +90,77 @@ def download_all_images(
         print("No records to download.")
         return
     
+    # Faces that share an image URL share one cached file, so fetch each URL once
+    unique = {}
+    for rec in records:
+        unique.setdefault(rec.image_url, rec)
+    if len(unique) < len(records):
+        print(f"Unique images: {len(unique):,} ({len(records) - len(unique):,} duplicate URLs skipped)")
+
+    # One directory listing instead of an exists()/stat() pair per record:
+    # already-cached images are counted up front and never submitted
+    with os.scandir(cache_dir) as it:
+        cached = {e.name for e in it if e.is_file() and e.stat().st_size > 0}
+    to_download = [rec for rec in unique.values() if safe_filename(rec.image_url) not in cached]
+    already_cached = len(unique) - len(to_download)
+    if already_cached:
+        print(f"Already cached: {already_cached:,}")
+
     # Create shared session with retry logic
     print(f"Initializing download session (workers={workers}, max_retries={max_retries})")
     with DownloadSession(
         max_retries=max_retries,
         timeout_connect=timeout_connect,
-        timeout_read=timeout_read
-    ) as session:
+        timeout_read=timeout_read,
+        pool_maxsize=workers
+    ) as session, batched_atomic_writes(cache_dir):
+        # Files are written without a per-file fsync; the cache directory is
+        # synced once when the batch ends
         # Download images in parallel
         failed = 0
-        succeeded = 0
+        succeeded = already_cached
         failed_downloads = []
         
         with ThreadPoolExecutor(max_workers=workers) as executor:
-            # Submit all download tasks
-            futures = {
-                executor.submit(download_single_image, rec["image_url"], cache_dir, session): rec
-                for rec in records
-            }
+            # Sliding window: keep a fixed number of downloads in flight and submit
+            # the next one as each finishes, instead of creating a future per
+            # record up front. A slow response only holds its own slot.
+            pending = iter(to_download)
+            futures = {}
+
+            def submit_next():
+                rec = next(pending, None)
+                if rec is not None:
+                    futures[executor.submit(download_single_image, rec.image_url, cache_dir, session)] = rec
+
+            for _ in range(2 * workers):
+                submit_next()
             
             # Process results with progress bar
-            with tqdm(total=len(records), desc="Downloading images") as pbar:
-                for future in as_completed(futures):
-                    rec = futures[future]
-                    result_path, error = future.result()
-                    if result_path is None:
-                        failed += 1
-                        failed_downloads.append({
-                            "name": rec.get("name", "unknown"),
-                            "scryfall_id": rec.get("scryfall_id", "unknown"),
-                            "url": rec["image_url"],
-                            "error": error or "Unknown error"
-                        })
-                    else:
-                        succeeded += 1
-                    pbar.update(1)
+            with tqdm(total=len(unique), initial=already_cached, desc="Downloading images") as pbar:
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        rec = futures.pop(future)
+                        submit_next()
+                        result_path, error = future.result()
+                        if result_path is None:
+                            failed += 1
+                            failed_downloads.append({
+                                "name": rec.name or "unknown",
+                                "scryfall_id": rec.scryfall_id or "unknown",
+                                "url": rec.image_url,
+                                "error": error or "Unknown error"
+                            })
+                        else:
+                            succeeded += 1
+                        pbar.update(1)
     
     print(f"\n=== Download Summary ===")
     print(f"Total faces: {len(records):,}")
+    print(f"Unique images: {len(unique):,}")
     print(f"Successfully cached: {succeeded:,}")
-    print(f"Failed downloads: {failed:,} ({safe_percentage(failed, len(records))})")
+    print(f"Failed downloads: {failed:,} ({safe_percentage(failed, len(unique))})")
     if failed > 0:
         print(f"\nFailed downloads:")
         for fail in failed_downloads[:10]:  # Show first 10
@@ -154,7 +168,7 @@ def download_all_images(
             print(f"    Error: {fail['error']}")
         if len(failed_downloads) > 10:
             print(f"  ... and {len(failed_downloads) - 10} more failures")
-    print(f"Success rate: {safe_percentage(succeeded, len(records))}")
+    print(f"Success rate: {safe_percentage(succeeded, len(unique))}")
     print(f"\nImages cached in: {cache_dir}")
     print(f"Next step: Run build_embeddings.py to create the index")
 
@@ -178,6 +192,10 @@ def main():
                     help="Read timeout in seconds (default: 30).")
     ap.add_argument("--max-retries", type=int, default=5,
                     help="Maximum retry attempts for failed downloads (default: 5).")
+    ap.add_argument("--bulk-cache", type=Path, default=Path("bulk_cache"),
+                    help="Directory to cache parsed Scryfall bulk metadata, reused until Scryfall publishes a new bulk (default: bulk_cache).")
+    ap.add_argument("--no-bulk-cache", dest="bulk_cache", action="store_const", const=None,
+                    help="Always download and parse the Scryfall bulk file.")
     args = ap.parse_args()
     
     # Validate CLI arguments
@@ -190,7 +208,8 @@ def main():
         workers=args.workers,
         timeout_connect=args.timeout_connect,
         timeout_read=args.timeout_read,
-        max_retries=args.max_retries
+        max_retries=args.max_retries,
+        bulk_cache=args.bulk_cache
     )
 
 
@@ -1,16 +1,71 @@
 import json
+import os
+import shutil
 import numpy as np
+import orjson
 import argparse
 import hashlib
 from pathlib import Path
 
+# Rows per chunk when streaming embeddings through memory (32 MB of float32 at 512-dim)
+TILE_ROWS = 16384
+# Rows checked for unit norm before falling back to a full pass
+NORM_SAMPLE_ROWS = 1024
+
+
+def iter_tiles(X, norms=None):
+    """Yield row tiles of X as private float32 arrays, divided by norms if given."""
+    for i in range(0, X.shape[0], TILE_ROWS):
+        tile = np.array(X[i:i + TILE_ROWS], dtype=np.float32)
+        if norms is not None:
+            tile /= norms[i:i + TILE_ROWS, np.newaxis]
+        yield tile
+
+
+def copy_npy_payload(src, dst):
+    """
+    Copy the raw array bytes of a .npy file to dst, dropping the .npy header.
+
+    Returns False without writing if the array is not little-endian C-order
+    float32, i.e. its bytes are not already the f32bin layout.
+    """
+    # np.load parses every .npy header version; the memmap's offset is where
+    # the array bytes start
+    try:
+        X = np.load(src, mmap_mode="r")
+    except ValueError:
+        return False  # e.g. an empty array, which cannot be mapped
+    if X.dtype != np.dtype("<f4") or not X.flags.c_contiguous:
+        return False
+    start, remaining = X.offset, X.nbytes
+    del X
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        offset = start
+        if hasattr(os, "copy_file_range"):
+            # In-kernel copy: the payload never passes through user space
+            try:
+                while remaining:
+                    n = os.copy_file_range(s.fileno(), d.fileno(), remaining, offset)
+                    if n == 0:
+                        raise SystemExit(f"{src} is truncated")
+                    offset += n
+                    remaining -= n
+            except OSError:
+                pass  # EXDEV, EINVAL, ENOTSUP...: copy the rest through user space
+        if remaining:
+            s.seek(offset)
+            d.seek(offset - start)
+            shutil.copyfileobj(s, d, 1 << 20)
+    return True
+
+
 def main():
     # --- CLI args ---
     ap = argparse.ArgumentParser(description="Export embeddings for browser")
     ap.add_argument("--input-dir", default="index_out", help="Input directory (default: index_out)")
     ap.add_argument("--output-dir", default="index_out", help="Output directory (default: index_out)")
-    ap.add_argument("--format", choices=["float32", "int8"], default="float32",
-                    help="Export format: float32 (no quantization, recommended) or int8 (75%% smaller, slight accuracy loss)")
+    ap.add_argument("--format", choices=["float32", "float16", "int8"], default="float32",
+                    help="Export format: float32 (no quantization, recommended), float16 (50%% smaller, negligible loss) or int8 (75%% smaller, slight accuracy loss)")
     args = ap.parse_args()
 
     # --- Paths ---
@@ -29,25 +84,36 @@ def main():
         raise SystemExit(f"Output directory {output_dir} is not accessible")
 
     # --- Load embeddings ---
-    X = np.load(EMB_NPY)  # float32 [N, D]
+    # Memory-mapped: rows are read tile by tile below, so RAM use stays at a
+    # few tiles however large the embedding set is
+    X = np.load(EMB_NPY, mmap_mode="r")  # float32 [N, D]
     print(f"Loaded embeddings: shape={X.shape}, dtype={X.dtype}")
 
     # --- Verify normalization ---
-    norms = np.linalg.norm(X, axis=1)
-    if not np.allclose(norms, 1.0, atol=1e-5):
+    # The builder L2-normalizes every row, so check a random sample of rows
+    # first and only compute every norm if the sample is off
+    idx = np.sort(np.random.default_rng(0).choice(X.shape[0], size=min(NORM_SAMPLE_ROWS, X.shape[0]), replace=False))
+    sample_ok = np.allclose(np.linalg.norm(np.asarray(X[idx], dtype=np.float32), axis=1), 1.0, atol=1e-5)
+    if not sample_ok:
+        norms = np.empty(X.shape[0], dtype=np.float32)
+        for i, tile in zip(range(0, X.shape[0], TILE_ROWS), iter_tiles(X)):
+            norms[i:i + len(tile)] = np.linalg.norm(tile, axis=1)
+    if not sample_ok and not np.allclose(norms, 1.0, atol=1e-5):
         print(f"⚠️  WARNING: Embeddings not properly normalized!")
         print(f"   Norms range: [{norms.min():.6f}, {norms.max():.6f}]")
-        print(f"   Re-normalizing now...")
-        X = X / norms[:, np.newaxis]
-        norms = np.linalg.norm(X, axis=1)
-        print(f"   ✓ Normalized. New norms range: [{norms.min():.6f}, {norms.max():.6f}]")
+        print(f"   Re-normalizing while writing...")
+        norms[norms == 0] = 1.0
+        renorm = norms
     else:
         print(f"✓ Embeddings properly normalized (norms within 1.0 ± 1e-5)")
+        renorm = None
 
     # --- Load metadata ---
-    meta = [json.loads(l) for l in META_LJL.open("r", encoding="utf-8")]
-    if len(meta) != X.shape[0]:
-        raise SystemExit(f"Meta len {len(meta)} != embeddings rows {X.shape[0]}")
+    # Each JSONL line is already one serialized record; they are spliced into
+    # meta.json as raw bytes below instead of being decoded and re-encoded
+    meta_lines = [l for l in META_LJL.read_bytes().splitlines() if l.strip()]
+    if len(meta_lines) != X.shape[0]:
+        raise SystemExit(f"Meta len {len(meta_lines)} != embeddings rows {X.shape[0]}")
 
     # --- Export based on format ---
     if args.format == "float32":
@@ -55,7 +121,11 @@ def main():
         OUT_BIN = output_dir / "embeddings.f32bin"
         OUT_META = output_dir / "meta.json"
 
-        X.tofile(OUT_BIN)
+        # Already-normalized float32 rows are byte-for-byte the f32bin payload
+        if renorm is not None or not copy_npy_payload(EMB_NPY, OUT_BIN):
+            with open(OUT_BIN, "wb") as f:
+                for tile in iter_tiles(X, renorm):
+                    tile.tofile(f)
         print(f"\nWrote {OUT_BIN} (float32, no quantization)")
         print(f"  Size: {X.nbytes/1e6:.1f} MB")
         print(f"  Shape: {X.shape}")
@@ -68,8 +138,38 @@ def main():
                 "original_dtype": "float32",
                 "note": "No quantization - embeddings are L2-normalized float32"
             },
-            "shape": list(X.shape),
-            "records": meta
+            "shape": list(X.shape)
+        }
+
+    elif args.format == "float16":
+        # Export as IEEE half precision (little-endian, readable as a Float16Array
+        # or decoded to Float32Array in the browser)
+        OUT_BIN = output_dir / "embeddings.f16bin"
+        OUT_META = output_dir / "meta.json"
+
+        # Convert each tile into one reused half-precision buffer instead of
+        # allocating a new float16 array per tile
+        buf16 = np.empty((min(TILE_ROWS, X.shape[0]), X.shape[1]), dtype="<f2")
+        with open(OUT_BIN, "wb") as f:
+            for tile in iter_tiles(X, renorm):
+                out = buf16[:len(tile)]
+                np.copyto(out, tile, casting="same_kind")
+                out.tofile(f)
+        f16_nbytes = X.size * 2
+
+        print(f"\nWrote {OUT_BIN} (float16)")
+        print(f"  Size reduction: {X.nbytes/1e6:.1f} MB (float32) → {f16_nbytes/1e6:.1f} MB (float16) = {100*(1-f16_nbytes/X.nbytes):.1f}% smaller")
+        print(f"  Shape: {X.shape}")
+
+        meta_with_header = {
+            "version": "1.0",
+            "quantization": {
+                "dtype": "float16",
+                "scale_factor": 1.0,
+                "original_dtype": "float32",
+                "note": "Half-precision copy of L2-normalized float32 embeddings; widen to float32 before use"
+            },
+            "shape": list(X.shape)
         }
 
     else:  # int8
@@ -79,11 +179,19 @@ def main():
 
         # IMPORTANT: Quantize NORMALIZED embeddings
         # Browser must re-normalize after dequantization to restore unit length
-        X_int8 = np.clip(X * 127, -127, 127).astype(np.int8)
-        X_int8.tofile(OUT_BIN)
+        # Each tile is a private float buffer, scaled/rounded/clipped in place;
+        # rounding to nearest (instead of astype's truncation toward zero)
+        # halves the error
+        with open(OUT_BIN, "wb") as f:
+            for tile in iter_tiles(X, renorm):
+                np.multiply(tile, 127, out=tile)
+                np.rint(tile, out=tile)
+                np.clip(tile, -127, 127, out=tile)
+                tile.astype(np.int8).tofile(f)
+        i8_nbytes = X.size
 
         print(f"\nWrote {OUT_BIN} (int8 quantized)")
-        print(f"  Size reduction: {X.nbytes/1e6:.1f} MB (float32) → {X_int8.nbytes/1e6:.1f} MB (int8) = {100*(1-X_int8.nbytes/X.nbytes):.1f}% smaller")
+        print(f"  Size reduction: {X.nbytes/1e6:.1f} MB (float32) → {i8_nbytes/1e6:.1f} MB (int8) = {100*(1-i8_nbytes/X.nbytes):.1f}% smaller")
         print(f"  Shape: {X.shape}")
         print(f"  ⚠️  NOTE: Browser must re-normalize after dequantization!")
 
@@ -95,8 +203,7 @@ def main():
                 "original_dtype": "float32",
                 "note": "Dequantize by dividing by 127, then L2-normalize each embedding to unit length"
             },
-            "shape": list(X.shape),
-            "records": meta
+            "shape": list(X.shape)
         }
 
     # --- Compute file hash for cache-busting ---
@@ -128,8 +235,14 @@ def main():
     else:
         print(f"  ⚠️  Warning: {BUILD_MANIFEST} not found, hash not added to build manifest")
 
-    OUT_META.write_text(json.dumps(meta_with_header, ensure_ascii=False), encoding="utf-8")
-    print(f"Wrote {OUT_META} ({len(meta)} records with quantization metadata)")
+    # "records" stays the last key: write the header object without its closing
+    # brace, then the record array
+    with open(OUT_META, "wb") as f:
+        f.write(orjson.dumps(meta_with_header)[:-1])
+        f.write(b',"records":[')
+        f.write(b",".join(meta_lines))
+        f.write(b"]}")
+    print(f"Wrote {OUT_META} ({len(meta_lines)} records with quantization metadata)")
     print(f"\n✓ Export complete! Format: {args.format}")
 
 if __name__ == "__main__":
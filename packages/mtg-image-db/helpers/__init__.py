@@ -6,19 +6,28 @@ This package provides utilities for:
 - Image validation
 - CLI argument validation
 - Atomic file operations
+- Image loading for embedding
 """
 from .session import DownloadSession
-from .validation import validate_image, validate_cache_directory
+from .validation import validate_image, validate_cache_directory, iter_validate_cache_directory
 from .cli_validation import validate_args, safe_percentage
-from .atomic_io import atomic_write, atomic_write_stream, cleanup_partial_files
+from .atomic_io import atomic_write, atomic_write_stream, sync_directory, batched_atomic_writes, cleanup_partial_files
+from .imaging import load_image_rgb, load_image_array, load_image_arrays, limit_worker_threads
 
 __all__ = [
     "DownloadSession",
     "validate_image",
     "validate_cache_directory",
+    "iter_validate_cache_directory",
     "validate_args",
     "safe_percentage",
     "atomic_write",
     "atomic_write_stream",
+    "sync_directory",
+    "batched_atomic_writes",
     "cleanup_partial_files",
+    "load_image_rgb",
+    "load_image_array",
+    "load_image_arrays",
+    "limit_worker_threads",
 ]
@@ -8,6 +8,23 @@ import sys
 from typing import Any
 
 
+# (argparse dest, predicate that is True for an invalid value, error message);
+# arguments a script does not define (or leaves as None) are skipped
+_RULES = [
+    ("limit", lambda v: v < 0, "--limit must be >= 0"),
+    ("batch", lambda v: v < 1, "--batch must be >= 1"),
+    ("size", lambda v: v < 64, "--size must be >= 64 (minimum for CLIP preprocessing)"),
+    ("workers", lambda v: v < 1 or v > 128, "--workers must be between 1 and 128"),
+    ("hnsw_m", lambda v: v < 4 or v > 128, "--hnsw-m must be between 4 and 128"),
+    ("hnsw_ef_construction", lambda v: v < 1 or v > 2000, "--hnsw-ef-construction must be between 1 and 2000"),
+    ("checkpoint_frequency", lambda v: v < 0, "--checkpoint-frequency must be >= 0 (0 disables checkpointing)"),
+    ("checkpoint_frequency", lambda v: 0 < v < 100, "--checkpoint-frequency must be >= 100 or 0 to disable"),
+    ("timeout_connect", lambda v: v < 1, "--timeout-connect must be >= 1 second"),
+    ("timeout_read", lambda v: v < 5, "--timeout-read must be >= 5 seconds"),
+    ("max_retries", lambda v: v < 0, "--max-retries must be >= 0"),
+]
+
+
 def validate_args(args: Any) -> None:
     """
     Validate CLI arguments and exit with clear error messages if invalid.
@@ -27,63 +44,16 @@ def validate_args(args: Any) -> None:
     Raises:
         SystemExit: If any validation fails (exit code 1)
     """
-    errors = []
-    
-    # Validate limit
-    if hasattr(args, "limit") and args.limit is not None:
-        if args.limit < 0:
-            errors.append("--limit must be >= 0")
-    
-    # Validate batch size
-    if hasattr(args, "batch") and args.batch is not None:
-        if args.batch < 1:
-            errors.append("--batch must be >= 1")
-    
-    # Validate image size
-    if hasattr(args, "size") and args.size is not None:
-        if args.size < 64:
-            errors.append("--size must be >= 64 (minimum for CLIP preprocessing)")
-    
-    # Validate worker count
-    if hasattr(args, "workers") and args.workers is not None:
-        if args.workers < 1 or args.workers > 128:
-            errors.append("--workers must be between 1 and 128")
-    
-    # Validate HNSW M parameter
-    if hasattr(args, "hnsw_m") and args.hnsw_m is not None:
-        if args.hnsw_m < 4 or args.hnsw_m > 128:
-            errors.append("--hnsw-m must be between 4 and 128")
-    
-    # Validate HNSW efConstruction parameter
-    if hasattr(args, "hnsw_ef_construction") and args.hnsw_ef_construction is not None:
-        if args.hnsw_ef_construction < 1 or args.hnsw_ef_construction > 2000:
-            errors.append("--hnsw-ef-construction must be between 1 and 2000")
-        
-        # Check efConstruction >= M
-        if hasattr(args, "hnsw_m") and args.hnsw_m is not None:
-            if args.hnsw_ef_construction < args.hnsw_m:
-                errors.append(f"--hnsw-ef-construction ({args.hnsw_ef_construction}) must be >= --hnsw-m ({args.hnsw_m})")
-    
-    # Validate checkpoint frequency
-    if hasattr(args, "checkpoint_frequency") and args.checkpoint_frequency is not None:
-        if args.checkpoint_frequency < 0:
-            errors.append("--checkpoint-frequency must be >= 0 (0 disables checkpointing)")
-        elif args.checkpoint_frequency > 0 and args.checkpoint_frequency < 100:
-            errors.append("--checkpoint-frequency must be >= 100 or 0 to disable")
-    
-    # Validate timeout values
-    if hasattr(args, "timeout_connect") and args.timeout_connect is not None:
-        if args.timeout_connect < 1:
-            errors.append("--timeout-connect must be >= 1 second")
-    
-    if hasattr(args, "timeout_read") and args.timeout_read is not None:
-        if args.timeout_read < 5:
-            errors.append("--timeout-read must be >= 5 seconds")
-    
-    # Validate max retries
-    if hasattr(args, "max_retries") and args.max_retries is not None:
-        if args.max_retries < 0:
-            errors.append("--max-retries must be >= 0")
+    opts = vars(args)
+    errors = [
+        message for name, is_invalid, message in _RULES
+        if opts.get(name) is not None and is_invalid(opts[name])
+    ]
+    
+    # Check efConstruction >= M
+    ef, m = opts.get("hnsw_ef_construction"), opts.get("hnsw_m")
+    if ef is not None and m is not None and ef < m:
+        errors.append(f"--hnsw-ef-construction ({ef}) must be >= --hnsw-m ({m})")
     
     # If any errors, print and exit
     if errors:
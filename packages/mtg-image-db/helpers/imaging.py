@@ -0,0 +1,261 @@
+"""
+Image loading for embedding.
+
+This module holds the card image preprocessing shared by the build and test
+scripts. It only depends on Pillow and NumPy so that decode worker processes
+can import it without pulling in torch, CLIP or FAISS.
+
+JPEG files are decoded with libjpeg-turbo through PyTurboJPEG when it is
+installed (optional); everything else, or a missing library, uses Pillow.
+"""
+import os
+import zipfile
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image, ImageEnhance, UnidentifiedImageError
+
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+except ImportError:
+    TurboJPEG = None
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+_JPEG_SUFFIXES = {".jpg", ".jpeg"}
+# Bump whenever load_image_array's output for the same file and settings
+# changes, so preprocessed arrays cached by older code are not reused
+_PREPROCESS_VERSION = 1
+_turbo = None
+
+
+def _get_turbo():
+    """Create the TurboJPEG decoder once per process; None if unavailable."""
+    global _turbo, TurboJPEG
+    if _turbo is None and TurboJPEG is not None:
+        try:
+            _turbo = TurboJPEG()
+        except (OSError, RuntimeError):
+            # Python package installed but libturbojpeg not found
+            TurboJPEG = None
+    return _turbo
+
+
+def _prefetch(paths: List[Path]) -> None:
+    """
+    Ask the kernel to start reading the given files into the page cache.
+
+    POSIX_FADV_WILLNEED schedules asynchronous readahead and returns
+    immediately, so later files in a batch are read from disk while earlier
+    ones are being decoded. No-op where posix_fadvise is unavailable.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue  # load_image_rgb reports unreadable files
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+def _open_rgb(path: Path, min_size: int) -> Image.Image:
+    """
+    Decode an image file to RGB, using libjpeg-turbo for JPEGs when available.
+
+    For JPEGs decoded by Pillow, draft mode lets libjpeg scale by 1/2, 1/4 or
+    1/8 during the IDCT as long as both sides stay >= min_size.
+    """
+    turbo = _get_turbo() if Path(path).suffix.lower() in _JPEG_SUFFIXES else None
+    if turbo is not None:
+        try:
+            return Image.fromarray(turbo.decode(Path(path).read_bytes(), pixel_format=TJPF_RGB))
+        except (OSError, ValueError):
+            pass  # Not a JPEG after all or corrupt; let Pillow decide
+    img = Image.open(path)
+    if img.format == "JPEG":
+        img.draft("RGB", (min_size, min_size))
+    return img.convert("RGB")
+
+
+def _load_card(path: Path, target_size: int, enhance_contrast: float) -> Image.Image:
+    """
+    Decode, contrast-enhance and resize a card so its longer side is target_size.
+
+    Raises UnidentifiedImageError/OSError for files that cannot be decoded.
+    """
+    # Decode at >= 2x the target so the final BICUBIC resize still has detail to work with
+    img = _open_rgb(path, min_size=2 * target_size)
+
+    # Enhance contrast if requested (helps with blurry cards)
+    if enhance_contrast > 1.0:
+        enhancer = ImageEnhance.Contrast(img)
+        img = enhancer.enhance(enhance_contrast)
+
+    # Resize the card itself before padding, so the black border never goes
+    # through the filter. reducing_gap lets Pillow box-reduce by an integer
+    # factor first, then resample the last <3x with BICUBIC.
+    w, h = img.size
+    s = max(w, h)
+    if s != target_size:
+        w = max(1, round(w * target_size / s))
+        h = max(1, round(h * target_size / s))
+        img = img.resize((w, h), Image.BICUBIC, reducing_gap=3.0)
+    return img
+
+
+def load_image_rgb(path: Path, target_size: int = 224, enhance_contrast: float = 1.0) -> Optional[Image.Image]:
+    """
+    Load a card image as a square RGB image ready for CLIP.
+
+    The card is contrast-enhanced (optional), resized to fit target_size and
+    centered on a black square canvas so no card information is cropped.
+
+    Args:
+        path: Image file to load
+        target_size: Output width/height in pixels (default: 224)
+        enhance_contrast: Contrast factor, 1.0 disables enhancement (default: 1.0)
+
+    Returns:
+        PIL RGB image of size (target_size, target_size), or None if the
+        file cannot be decoded
+    """
+    try:
+        img = _load_card(path, target_size, enhance_contrast)
+    except (UnidentifiedImageError, OSError):
+        return None
+
+    # Pad to square with black borders to preserve all card information
+    # (card name, mana cost, text box, P/T are important for detection)
+    w, h = img.size
+    padded = Image.new("RGB", (target_size, target_size), (0, 0, 0))
+    padded.paste(img, ((target_size - w) // 2, (target_size - h) // 2))
+    return padded
+
+
+def load_image_array(path: Path, target_size: int = 224, enhance_contrast: float = 1.0) -> Optional[np.ndarray]:
+    """
+    Same as load_image_rgb, but returns a (target_size, target_size, 3) uint8 array.
+
+    The resized card is copied straight into a zeroed array instead of going
+    through a padded PIL image and a second conversion copy. Arrays pickle as
+    a single buffer, which keeps the transfer cheap when images are decoded
+    in worker processes.
+    """
+    try:
+        img = _load_card(path, target_size, enhance_contrast)
+    except (UnidentifiedImageError, OSError):
+        return None
+
+    w, h = img.size
+    top, left = (target_size - h) // 2, (target_size - w) // 2
+    canvas = np.zeros((target_size, target_size, 3), dtype=np.uint8)
+    canvas[top:top + h, left:left + w] = np.asarray(img)
+    return canvas
+
+
+def _array_cache_path(array_cache_dir: Path, path: Path, target_size: int, enhance_contrast: float) -> Path:
+    """
+    Cache file for a preprocessed image; one per source name and preprocessing settings.
+
+    A re-downloaded image overwrites its entry instead of leaving an orphan;
+    _array_cache_key inside the entry tells whether it is still current.
+    """
+    return Path(array_cache_dir) / f"{Path(path).stem}_{target_size}_{enhance_contrast:g}.npz"
+
+
+def _array_cache_key(path: Path) -> Optional[str]:
+    """
+    Fingerprint of everything besides the settings that decides a cached array's pixels.
+
+    Covers the source's mtime and size (a re-downloaded image is preprocessed
+    again), the JPEG decoder in use (libjpeg-turbo and Pillow's draft mode
+    produce different pixels) and _PREPROCESS_VERSION. None if the source
+    cannot be stat'ed.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    decoder = "tj" if Path(path).suffix.lower() in _JPEG_SUFFIXES and _get_turbo() is not None else "pil"
+    return f"v{_PREPROCESS_VERSION}_{decoder}_{st.st_mtime_ns}_{st.st_size}"
+
+
+def _load_array(path: Path, key: str) -> Optional[np.ndarray]:
+    """Read an array cache entry; None if it is missing, unreadable or stale."""
+    try:
+        with np.load(path) as entry:
+            if str(entry["key"]) == key:
+                return entry["image"]
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        pass  # not cached yet, or a truncated entry: rebuild it
+    return None
+
+
+def _save_array(path: Path, arr: np.ndarray, key: str) -> None:
+    """Write an array cache entry atomically (other workers may read it concurrently)."""
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            np.savez(f, image=arr, key=np.array(key))
+        os.replace(tmp, path)
+    except OSError:
+        tmp.unlink(missing_ok=True)  # caching is best-effort
+
+
+def load_image_arrays(
+    paths: List[Path],
+    target_size: int = 224,
+    enhance_contrast: float = 1.0,
+    array_cache_dir: Optional[Path] = None
+) -> List[Optional[np.ndarray]]:
+    """
+    Batch form of load_image_array, for use as a single worker-pool task.
+
+    With array_cache_dir, each preprocessed array is stored there as .npz and
+    reused on later runs with the same target_size and enhance_contrast (as
+    long as the source file and decoder are unchanged), so rebuilds skip
+    decode, contrast and resize entirely.
+
+    Returns one entry per path, in order; entries are None for files that
+    cannot be decoded.
+    """
+    if array_cache_dir is None:
+        _prefetch(paths)
+        return [load_image_array(p, target_size=target_size, enhance_contrast=enhance_contrast) for p in paths]
+
+    cached = [_array_cache_path(array_cache_dir, p, target_size, enhance_contrast) for p in paths]
+    _prefetch([c if c.exists() else p for p, c in zip(paths, cached)])
+    out: List[Optional[np.ndarray]] = []
+    for p, c in zip(paths, cached):
+        key = _array_cache_key(p)
+        arr = _load_array(c, key) if key is not None else None
+        if arr is None:
+            arr = load_image_array(p, target_size=target_size, enhance_contrast=enhance_contrast)
+            if arr is not None and key is not None:
+                _save_array(c, arr, key)
+        out.append(arr)
+    return out
+
+
+def limit_worker_threads() -> None:
+    """
+    Process-pool initializer that keeps each decode worker single-threaded.
+
+    Workers inherit (fork) or re-import (spawn) the parent's NumPy/FAISS
+    modules, whose BLAS pools default to one thread per core. With several
+    workers next to the main process that oversubscribes the CPU, so cap the
+    BLAS pools at 1 thread. threadpoolctl ships with the environment-*.yml
+    files; without it (e.g. a hand-assembled pip setup) this is a no-op.
+    """
+    if threadpool_limits is not None:
+        threadpool_limits(limits=1, user_api="blas")
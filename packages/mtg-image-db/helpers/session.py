@@ -17,7 +17,7 @@ class DownloadSession:
     - Automatic retries on rate limits (429) and server errors (5xx)
     - Exponential backoff: 1s, 2s, 4s, 8s, 16s (capped at 60s)
     - Polite User-Agent header
-    - Connection pooling for efficiency
+    - Connection pooling sized to the number of download workers
     - Configurable timeouts
     """
     
@@ -27,6 +27,7 @@ class DownloadSession:
         backoff_factor: float = 1.0,
         timeout_connect: int = 5,
         timeout_read: int = 30,
+        pool_maxsize: int = 20,
         user_agent: str = "MTG-Image-DB/1.0 (+https://github.com/FrimJo/spell-coven-mono; ifrim@me.com)"
     ):
         """
@@ -38,6 +39,10 @@ class DownloadSession:
                            Produces delays: 1s, 2s, 4s, 8s, 16s
             timeout_connect: Connection timeout in seconds (default: 5)
             timeout_read: Read timeout in seconds (default: 30)
+            pool_maxsize: Connections kept alive per host (default: 20).
+                          Should be >= the number of threads sharing the session,
+                          otherwise extra connections are discarded after each
+                          request and every download pays a fresh TLS handshake.
             user_agent: User-Agent header string
         """
         self.timeout = (timeout_connect, timeout_read)
@@ -53,7 +58,11 @@ class DownloadSession:
         
         # Create session with retry adapter
         self.session = requests.Session()
-        adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=10, pool_maxsize=20)
+        adapter = HTTPAdapter(
+            max_retries=retry_strategy,
+            pool_connections=10,
+            pool_maxsize=max(20, pool_maxsize)
+        )
         self.session.mount("http://", adapter)
         self.session.mount("https://", adapter)
         
@@ -4,17 +4,39 @@ Image validation functions for cache integrity.
 This module provides functions to validate cached image files before embedding,
 preventing corrupted data from entering the pipeline.
 """
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Iterator, Optional
+
 from PIL import Image, UnidentifiedImageError
 
+from .atomic_io import atomic_write
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+# Per-directory record of earlier verdicts: {name: [mtime_ns, size, is_valid, error]}
+VALIDATION_MEMO = ".validate_cache.json"
+
+
+def _sniff_magic(head: bytes) -> bool:
+    """True if head starts like a JPEG, PNG, GIF or WebP file."""
+    return (
+        head.startswith((b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n", b"GIF87a", b"GIF89a"))
+        or (head[:4] == b"RIFF" and head[8:12] == b"WEBP")
+    )
+
 
 def validate_image(path: Path) -> tuple[bool, str | None]:
     """
     Validate that a file is a valid, loadable image.
     
-    Performs two-stage validation:
-    1. Image.verify() - checks file integrity without full decode
-    2. Image.load() - ensures the image can actually be decoded
+    Opens the file once and checks its first bytes against the JPEG, PNG,
+    GIF and WebP signatures, so HTML error pages and other junk are rejected
+    without invoking Pillow. Files that pass are fully decoded with
+    Image.load(), which raises on corrupt data and truncated files. A
+    separate Image.verify() pass would need a second open and header parse,
+    since verify() closes the file.
     
     Args:
         path: Path to image file to validate
@@ -30,22 +52,24 @@ def validate_image(path: Path) -> tuple[bool, str | None]:
         >>> validate_image(Path("corrupted.jpg"))
         (False, "Truncated file")
         >>> validate_image(Path("error.html"))
-        (False, "Not a valid image format")
+        (False, "Not a valid image format (bad magic bytes)")
     """
-    if not path.exists():
+    try:
+        size = path.stat().st_size
+    except FileNotFoundError:
         return False, "File does not exist"
     
-    if path.stat().st_size == 0:
+    if size == 0:
         return False, "File is empty (0 bytes)"
     
     try:
-        # First pass: verify file integrity
-        with Image.open(path) as img:
-            img.verify()
-        
-        # Second pass: ensure decodable (verify() closes the file)
-        with Image.open(path) as img:
-            img.load()
+        with open(path, "rb") as f:
+            if not _sniff_magic(f.read(16)):
+                return False, "Not a valid image format (bad magic bytes)"
+            f.seek(0)
+            # Full decode; truncated data raises OSError here
+            with Image.open(f) as img:
+                img.load()
         
         return True, None
     
@@ -62,12 +86,78 @@ def validate_image(path: Path) -> tuple[bool, str | None]:
         return False, f"Validation error: {str(e)}"
 
 
-def validate_cache_directory(cache_dir: Path) -> dict:
+def iter_validate_cache_directory(
+    cache_dir: Path,
+    workers: Optional[int] = None,
+    memo: bool = True
+) -> Iterator[tuple[str, bool, str | None]]:
+    """
+    Validate all image files in a cache directory, yielding results as they come.
+    
+    Files are listed with one os.scandir pass and validated on a thread
+    pool; Pillow releases the GIL while decoding, so threads scale with cores.
+    
+    With memo, verdicts are stored in cache_dir/.validate_cache.json keyed by
+    file name, mtime and size, and reused while a file is unchanged, so later
+    runs only decode new or modified files. The memo is written once the
+    iterator is exhausted.
+    
+    Args:
+        cache_dir: Path to cache directory
+        workers: Validation threads (default: 2x CPU count)
+        memo: Reuse and update remembered verdicts (default: True)
+    
+    Yields:
+        (file name, is_valid, error_message) per image file, in directory order
+    """
+    if not cache_dir.exists():
+        return
+    
+    # Check all image files (common extensions)
+    with os.scandir(cache_dir) as it:
+        keys = {
+            e.name: [st.st_mtime_ns, st.st_size]
+            for e in it if e.name.endswith(IMAGE_SUFFIXES) and e.is_file()
+            for st in (e.stat(),)
+        }
+    
+    memo_path = cache_dir / VALIDATION_MEMO
+    known = {}
+    if memo:
+        try:
+            known = json.loads(memo_path.read_bytes())
+        except (OSError, ValueError):
+            pass  # first run, or an unreadable memo: validate everything
+    
+    verdicts = {}
+    for name, key in keys.items():
+        entry = known.get(name)
+        if isinstance(entry, list) and entry[:2] == key:
+            verdicts[name] = (entry[2], entry[3])
+    stale = [name for name in keys if name not in verdicts]
+    
+    with ThreadPoolExecutor(max_workers=workers or 2 * (os.cpu_count() or 1)) as executor:
+        checked = executor.map(validate_image, [cache_dir / name for name in stale])
+        for name in keys:
+            if name not in verdicts:
+                verdicts[name] = next(checked)
+            yield (name, *verdicts[name])
+    
+    if memo and (stale or len(known) != len(keys)):
+        entries = {name: key + list(verdicts[name]) for name, key in keys.items()}
+        atomic_write(memo_path, json.dumps(entries).encode("utf-8"), fsync=False)
+
+
+def validate_cache_directory(cache_dir: Path, workers: Optional[int] = None, memo: bool = True) -> dict:
     """
     Validate all image files in a cache directory.
     
+    Collects iter_validate_cache_directory into one summary.
+    
     Args:
         cache_dir: Path to cache directory
+        workers: Validation threads (default: 2x CPU count)
+        memo: Reuse and update remembered verdicts (default: True)
     
     Returns:
         Dictionary with validation results:
@@ -85,22 +175,16 @@ def validate_cache_directory(cache_dir: Path) -> dict:
         "failures": []
     }
     
-    if not cache_dir.exists():
-        return results
-    
-    # Check all image files (common extensions)
-    for ext in ["*.jpg", "*.jpeg", "*.png", "*.gif", "*.webp"]:
-        for path in cache_dir.glob(ext):
-            results["total"] += 1
-            is_valid, error = validate_image(path)
-            
-            if is_valid:
-                results["valid"] += 1
-            else:
-                results["invalid"] += 1
-                results["failures"].append({
-                    "path": str(path.name),
-                    "reason": error
-                })
+    for name, is_valid, error in iter_validate_cache_directory(cache_dir, workers, memo):
+        results["total"] += 1
+        
+        if is_valid:
+            results["valid"] += 1
+        else:
+            results["invalid"] += 1
+            results["failures"].append({
+                "path": name,
+                "reason": error
+            })
     
     return results
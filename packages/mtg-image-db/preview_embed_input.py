@@ -1,34 +1,13 @@
 #!/usr/bin/env python3
 """
 Preview how a single card image is processed before embedding.
-This mirrors the preprocessing in build_embeddings.py (contrast, pad-to-square, resize).
+Uses the same load_image_rgb as build_embeddings.py (contrast, pad-to-square, resize).
 """
 import argparse
 from pathlib import Path
 
-from PIL import Image, ImageEnhance, UnidentifiedImageError
-
 from config import get_default_contrast
-
-
-def process_image(path: Path, target_size: int, enhance_contrast: float) -> Image.Image:
-    img = Image.open(path).convert("RGB")
-
-    if enhance_contrast > 1.0:
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(enhance_contrast)
-
-    w, h = img.size
-    s = max(w, h)
-    padded = Image.new("RGB", (s, s), (0, 0, 0))
-    paste_x = (s - w) // 2
-    paste_y = (s - h) // 2
-    padded.paste(img, (paste_x, paste_y))
-
-    if s != target_size:
-        padded = padded.resize((target_size, target_size), Image.BICUBIC)
-
-    return padded
+from helpers import load_image_rgb
 
 
 def main() -> None:
@@ -59,10 +38,9 @@ def main() -> None:
 
     out_path.parent.mkdir(parents=True, exist_ok=True)
 
-    try:
-        processed = process_image(in_path, args.size, args.contrast)
-    except (UnidentifiedImageError, OSError) as exc:
-        raise SystemExit(f"Failed to read image: {exc}") from exc
+    processed = load_image_rgb(in_path, target_size=args.size, enhance_contrast=args.contrast)
+    if processed is None:
+        raise SystemExit(f"Failed to read image: {in_path}")
 
     processed.save(out_path)
     print(f"Saved processed image to {out_path}")
@@ -1,4 +1,4 @@
-import json
+import orjson
 import argparse
 import faiss
 import torch
@@ -7,8 +7,12 @@ from PIL import Image
 import numpy as np
 
 # --- Load FAISS + metadata ---
-index = faiss.read_index("index_out/mtg_cards.faiss")
-meta = [json.loads(line) for line in open("index_out/mtg_meta.jsonl", "r", encoding="utf-8")]
+# FAISS only memory-maps IVF inverted lists, so IO_FLAG_MMAP applies to the
+# IVF-Flat index written by --gpu-index; the default HNSW index is still read
+# fully into memory
+index = faiss.read_index("index_out/mtg_cards.faiss", faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+with open("index_out/mtg_meta.jsonl", "rb") as f:
+    meta = [orjson.loads(line) for line in f]
 
 # --- Init CLIP ---
 device = "mps" if torch.backends.mps.is_available() else (
@@ -18,28 +22,31 @@ print("Using device:", device)
 
 model, preprocess = clip.load("ViT-B/32", device=device)
 
-def embed_image(img_path: str) -> np.ndarray:
-    img = Image.open(img_path).convert("RGB")
+def embed_images(img_paths: list[str]) -> np.ndarray:
+    """Embed several query images with one batched forward pass; returns [n, 512] float32."""
+    x = torch.stack([preprocess(Image.open(p).convert("RGB")) for p in img_paths]).to(device)
     with torch.no_grad():
-        x = preprocess(img).unsqueeze(0).to(device)
         v = model.encode_image(x)
         v = v / v.norm(dim=-1, keepdim=True)
     return v.cpu().numpy().astype("float32")
 
+def embed_image(img_path: str) -> np.ndarray:
+    return embed_images([img_path])
+
 if __name__ == "__main__":
     # --- CLI args ---
     ap = argparse.ArgumentParser(description="Query the MTG FAISS index with a local image")
-    ap.add_argument("query_path", help="Path to query image")
+    ap.add_argument("query_paths", nargs="+", help="Path(s) to query image(s); several are embedded as one batch")
     ap.add_argument("--k", type=int, default=1, help="Number of top results to return (default: 1)")
     args = ap.parse_args()
 
     # --- Query ---
-    query_path = args.query_path
-    vec = embed_image(query_path)
-    D, I = index.search(vec, k=args.k)
-
-    print(f"\nTop {args.k} matches for:", query_path)
-    for rank, (dist, idx) in enumerate(zip(D[0], I[0]), 1):
-        m = meta[int(idx)]
-        score = dist  # IndexFlatIP returns dot product (cosine for normalized vectors)
-        print(f"{rank}. {m['name']} [{m['set']}] score={score:.3f} url={m['image_url']}")
+    vecs = embed_images(args.query_paths)
+    D, I = index.search(vecs, k=args.k)
+
+    for query_path, dists, ids in zip(args.query_paths, D, I):
+        print(f"\nTop {args.k} matches for:", query_path)
+        for rank, (dist, idx) in enumerate(zip(dists, ids), 1):
+            m = meta[int(idx)]  # ids are positional: row i of the index is line i of mtg_meta.jsonl
+            score = dist  # METRIC_INNER_PRODUCT returns dot product (cosine for normalized vectors)
+            print(f"{rank}. {m['name']} [{m['set']}] score={score:.3f} url={m['image_url']}")
@@ -15,11 +15,18 @@ Exit codes:
   3 - Other error (e.g., SPEC.md missing)
 """
 import argparse
+import mmap
 import os
-import re
 import sys
 from typing import Set, List
 
+try:
+    # Optional: google-re2 compiles the pattern to a DFA and scans in linear time.
+    # The pattern below uses no backreferences or lookaround, so results match `re`.
+    import re2 as re
+except ImportError:
+    import re
+
 REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 SPEC_PATH = os.path.join(REPO_ROOT, "SPEC.md")
 
@@ -27,7 +34,10 @@ SPEC_PATH = os.path.join(REPO_ROOT, "SPEC.md")
 #  - SPEC-FR-DA, SPEC-FR-DA-01, SPEC-FR-EI-02c
 #  - SPEC-ARCH-BR-SEARCH
 #  - SPEC-AC-BUILD-01.1
-SPEC_ID_REGEX = re.compile(r"\bSPEC-[A-Z]+(?:-[A-Z0-9]+)*(?:-\d+(?:\.\d+)?[a-z]?)?\b")
+SPEC_ID_PATTERN = r"\bSPEC-[A-Z]+(?:-[A-Z0-9]+)*(?:-\d+(?:\.\d+)?[a-z]?)?\b"
+SPEC_ID_REGEX = re.compile(SPEC_ID_PATTERN)
+# Bytes variant for scanning SPEC.md in place through mmap (IDs are pure ASCII)
+SPEC_ID_BYTES_REGEX = re.compile(SPEC_ID_PATTERN.encode("ascii"))
 
 
 def extract_spec_ids_from_text(text: str) -> List[str]:
@@ -37,9 +47,12 @@ def extract_spec_ids_from_text(text: str) -> List[str]:
 def load_spec_ids_from_spec_md(path: str) -> Set[str]:
     if not os.path.exists(path):
         raise FileNotFoundError(f"SPEC.md not found at: {path}")
-    with open(path, "r", encoding="utf-8") as f:
-        content = f.read()
-    return set(extract_spec_ids_from_text(content))
+    if os.path.getsize(path) == 0:
+        return set()  # mmap cannot map an empty file
+    # Scan the mapped file directly: no full read into memory and no UTF-8 decode,
+    # only the matched IDs are decoded. finditer (unlike re2's findall) accepts mmap.
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return {m.group().decode("ascii") for m in SPEC_ID_BYTES_REGEX.finditer(mm)}
 
 
 def main(argv: List[str]) -> int:
@@ -1,8 +1,8 @@
 #!/usr/bin/env node
-import { put } from '@vercel/blob'
+import { copy, put } from '@vercel/blob'
 import dotenv from 'dotenv'
 import { createReadStream, existsSync, statSync } from 'node:fs'
-import { resolve } from 'node:path'
+import { extname, resolve } from 'node:path'
 import { execSync } from 'node:child_process'
 import { fileURLToPath } from 'node:url'
 
@@ -47,16 +47,20 @@ function computeDefaultVersion() {
   return `v${date}-${sha}`
 }
 
+// Same cap as deploy_to_blob.py's UPLOAD_WORKERS
+const UPLOAD_CONCURRENCY = 4
+
+const CONTENT_TYPES = { '.json': 'application/json' }
+
 function contentTypeFor(fileName) {
-  if (fileName.endsWith('.json')) return 'application/json'
-  return 'application/octet-stream'
+  return CONTENT_TYPES[extname(fileName)] || 'application/octet-stream'
 }
 
 async function uploadFile({ token, pathname, filePath, dryRun, allowOverwrite }) {
   if (!existsSync(filePath)) {
     return { ok: false, message: `Missing file: ${filePath}` }
   }
-  const sizeMb = statSync(filePath).st_size / 1e6
+  const sizeMb = statSync(filePath).size / 1e6
   console.log(`📤 Uploading ${filePath} (${sizeMb.toFixed(1)} MB) → ${pathname}`)
   if (dryRun) {
     return { ok: true, url: null }
@@ -73,6 +77,23 @@ async function uploadFile({ token, pathname, filePath, dryRun, allowOverwrite })
   return { ok: true, url: result.url }
 }
 
+// Server-side copy of an already uploaded blob, so mirrors cost no upload bytes
+async function copyBlob({ token, fromUrl, pathname, filePath, dryRun }) {
+  console.log(`📋 Copying ${fromUrl || filePath} → ${pathname}`)
+  if (dryRun) {
+    return { ok: true, url: null }
+  }
+
+  const result = await copy(fromUrl, pathname, {
+    access: 'public',
+    addRandomSuffix: false,
+    allowOverwrite: true,
+    token,
+    contentType: contentTypeFor(filePath),
+  })
+  return { ok: true, url: result.url }
+}
+
 async function main() {
   loadEnvFiles()
   const args = parseArgs(process.argv)
@@ -106,24 +127,37 @@ async function main() {
 
   const files = [
     'embeddings.f32bin',
+    'embeddings.f16bin',
     'embeddings.i8bin',
     'meta.json',
     'build_manifest.json',
   ]
 
+  // Each file is uploaded once, to the first target; the other targets get
+  // server-side copies of that blob
+  const [primary, ...mirrors] = targets
+  const uploads = []
+  for (const fileName of files) {
+    const filePath = resolve(inputDir, fileName)
+    if (!existsSync(filePath)) continue
+    uploads.push({ fileName, filePath })
+  }
+
   let success = 0
-  let total = 0
-  for (const target of targets) {
-    // Allow overwrite for all targets:
-    // - Channels (latest-dev, latest-prod) are mutable and should be overwritable
-    // - Snapshots (v20260122-aa6bbcd) should also allow overwrite since version names
-    //   are deterministic (date+sha), so redeploying the same version should update it
-    for (const fileName of files) {
-      const filePath = resolve(inputDir, fileName)
-      if (!existsSync(filePath)) continue
-      total += 1
-      const pathname = `${target}/${fileName}`
+  const total = uploads.length * targets.length
+  let next = 0
+  // Uploads are network-bound: keep a few in flight so the total time is not
+  // the sum of every file's round trips
+  async function uploadWorker() {
+    while (next < uploads.length) {
+      const { fileName, filePath } = uploads[next++]
+      const pathname = `${primary}/${fileName}`
+      let primaryUrl
       try {
+        // Allow overwrite for all targets:
+        // - Channels (latest-dev, latest-prod) are mutable and should be overwritable
+        // - Snapshots (v20260122-aa6bbcd) should also allow overwrite since version names
+        //   are deterministic (date+sha), so redeploying the same version should update it
         const result = await uploadFile({
           token,
           pathname,
@@ -131,12 +165,41 @@ async function main() {
           dryRun,
           allowOverwrite: true
         })
-        if (result.ok) success += 1
+        if (!result.ok) continue
+        success += 1
+        primaryUrl = result.url
       } catch (err) {
         console.error(`❌ Upload error for ${pathname}:`, err?.message || err)
+        continue
+      }
+
+      for (const mirror of mirrors) {
+        const mirrorPath = `${mirror}/${fileName}`
+        try {
+          await copyBlob({ token, fromUrl: primaryUrl, pathname: mirrorPath, filePath, dryRun })
+          success += 1
+        } catch (err) {
+          // Copy not available (older store/SDK): fall back to a second upload
+          console.warn(`⚠️  Copy failed for ${mirrorPath} (${err?.message || err}), uploading instead`)
+          try {
+            const result = await uploadFile({
+              token,
+              pathname: mirrorPath,
+              filePath,
+              dryRun,
+              allowOverwrite: true
+            })
+            if (result.ok) success += 1
+          } catch (uploadErr) {
+            console.error(`❌ Upload error for ${mirrorPath}:`, uploadErr?.message || uploadErr)
+          }
+        }
       }
     }
   }
+  await Promise.all(
+    Array.from({ length: Math.min(UPLOAD_CONCURRENCY, uploads.length) }, uploadWorker)
+  )
 
   console.log(`\n${'='.repeat(60)}`)
   console.log(`✓ Upload complete: ${success}/${total} files uploaded successfully`)
@@ -28,27 +28,18 @@ a   = arr[..., 3:4]
 lum = (0.2126 * rgb[..., 0] + 0.7152 * rgb[..., 1] + 0.0722 * rgb[..., 2])
 
 # Piecewise remap luminance -> palette ramps
-target = np.zeros_like(rgb)
-
-m0 = lum < 0.12
-m1 = (lum >= 0.12) & (lum < 0.28)
-m2 = (lum >= 0.28) & (lum < 0.50)
-m3 = (lum >= 0.50) & (lum < 0.75)
-m4 = lum >= 0.75
-
-target[m0] = c_card
-
-t = (lum[m1] - 0.12) / (0.28 - 0.12)
-target[m1] = c_card * (1 - t[..., None]) + c_sec * t[..., None]
-
-t = (lum[m2] - 0.28) / (0.50 - 0.28)
-target[m2] = c_sec * (1 - t[..., None]) + c_surf3 * t[..., None]
-
-t = (lum[m3] - 0.50) / (0.75 - 0.50)
-target[m3] = c_brand * (1 - t[..., None]) + c_primary * t[..., None]
-
-t = (lum[m4] - 0.75) / (1.00 - 0.75)
-target[m4] = c_primary * (1 - t[..., None]) + c_text * t[..., None]
+# Each bucket blends lo_color -> hi_color across [lo_edge, hi_edge); one
+# searchsorted picks every pixel's bucket, so the image is interpolated in a
+# single pass instead of one masked pass per bucket
+bounds   = np.array([0.12, 0.28, 0.50, 0.75], dtype=np.float32)
+lo_edge  = np.array([0.00, 0.12, 0.28, 0.50, 0.75], dtype=np.float32)
+hi_edge  = np.array([0.12, 0.28, 0.50, 0.75, 1.00], dtype=np.float32)
+lo_color = np.stack([c_card, c_card, c_sec,   c_brand,   c_primary])
+hi_color = np.stack([c_card, c_sec,  c_surf3, c_primary, c_text])
+
+idx = np.searchsorted(bounds, lum, side="right")
+t = (lum - lo_edge[idx]) / (hi_edge[idx] - lo_edge[idx])
+target = lo_color[idx] * (1 - t[..., None]) + hi_color[idx] * t[..., None]
 
 # Keep already-bluish bright elements (sun/stars) closer to text/primary
 r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
@@ -58,13 +49,20 @@ adj = c_primary * (1 - t[..., None]) + c_text2 * t[..., None]
 target[bluish] = adj[bluish]
 
 # Mix in some original detail so the icon keeps its shading
+# (in place on target/rgb: each step rewrites the same buffer instead of
+# allocating another full-image float array)
 mix = 0.72
-out_rgb = target * mix + rgb * (1 - mix)
+np.multiply(target, mix, out=target)
+np.multiply(rgb, 1 - mix, out=rgb)
+out_rgb = np.add(target, rgb, out=target)
 
 # Subtle cool tint
-out_rgb = np.clip(out_rgb * np.array([0.95, 0.98, 1.05]), 0, 1)
+np.multiply(out_rgb, np.array([0.95, 0.98, 1.05], dtype=np.float32), out=out_rgb)
+np.clip(out_rgb, 0, 1, out=out_rgb)
 
-out = np.concatenate([out_rgb, a], axis=-1)
-Image.fromarray((out * 255).astype(np.uint8), "RGBA").save(out_path)
+out = np.empty(arr.shape, dtype=np.uint8)
+out[..., :3] = np.multiply(out_rgb, 255, out=out_rgb)
+out[..., 3:] = np.multiply(a, 255, out=a)
+Image.fromarray(out, "RGBA").save(out_path)
 
 print("Saved:", out_path)
@@ -11,7 +11,7 @@ from pathlib import Path
 
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent.parent))
-from helpers import validate_cache_directory
+from helpers import iter_validate_cache_directory
 
 
 def main():
@@ -24,6 +24,10 @@ def main():
                     help="Remove corrupted files (use with caution).")
     ap.add_argument("--report", default=None,
                     help="Write validation report to this file (JSON format).")
+    ap.add_argument("--workers", type=int, default=None,
+                    help="Validation threads (default: 2x CPU count).")
+    ap.add_argument("--no-memo", dest="memo", action="store_false", default=True,
+                    help="Re-validate every file instead of reusing verdicts for unchanged files from earlier runs.")
     args = ap.parse_args()
     
     cache_dir = Path(args.cache)
@@ -35,8 +39,50 @@ def main():
     print(f"Validating images in: {cache_dir}")
     print("=" * 60)
     
-    # Run validation
-    results = validate_cache_directory(cache_dir)
+    # Run validation, handling each file as its result arrives: failures are
+    # printed, removed (--fix) and appended to the report without keeping a
+    # list of them in memory
+    report = None
+    if args.report:
+        import orjson
+        report_path = Path(args.report)
+        report = open(report_path, "wb")
+        report.write(b'{\n  "failures": [')
+    
+    results = {"total": 0, "valid": 0, "invalid": 0}
+    removed = 0
+    try:
+        for name, is_valid, error in iter_validate_cache_directory(cache_dir, workers=args.workers, memo=args.memo):
+            results["total"] += 1
+            if is_valid:
+                results["valid"] += 1
+                continue
+            
+            results["invalid"] += 1
+            if results["invalid"] == 1:
+                print(f"\nInvalid files:")
+            print(f"  - {name}: {error}")
+            
+            if report is not None:
+                report.write(b"," if results["invalid"] > 1 else b"")
+                report.write(b"\n    " + orjson.dumps({"path": name, "reason": error}))
+            
+            # Fix corrupted files if requested
+            if args.fix:
+                try:
+                    (cache_dir / name).unlink()
+                    removed += 1
+                except Exception as e:
+                    print(f"  Failed to remove {name}: {e}")
+        
+        if report is not None:
+            report.write(b"\n  ]" if results["invalid"] else b"]")
+            for key, value in results.items():
+                report.write(f',\n  "{key}": {value}'.encode("utf-8"))
+            report.write(b"\n}\n")
+    finally:
+        if report is not None:
+            report.close()
     
     # Display results
     print(f"\nValidation Results:")
@@ -44,30 +90,10 @@ def main():
     print(f"  Valid images: {results['valid']:,}")
     print(f"  Invalid images: {results['invalid']:,}")
     
-    if results['invalid'] > 0:
-        print(f"\nInvalid files:")
-        for failure in results['failures']:
-            print(f"  - {failure['path']}: {failure['reason']}")
-    
-    # Fix corrupted files if requested
     if args.fix and results['invalid'] > 0:
-        print(f"\n⚠️  Removing {results['invalid']} corrupted files...")
-        removed = 0
-        for failure in results['failures']:
-            file_path = cache_dir / failure['path']
-            try:
-                file_path.unlink()
-                removed += 1
-            except Exception as e:
-                print(f"  Failed to remove {failure['path']}: {e}")
-        print(f"✓ Removed {removed} corrupted files")
+        print(f"\n✓ Removed {removed} of {results['invalid']} corrupted files")
     
-    # Write report if requested
-    if args.report:
-        import json
-        report_path = Path(args.report)
-        with open(report_path, 'w') as f:
-            json.dump(results, f, indent=2)
+    if report is not None:
         print(f"\n✓ Validation report written to: {report_path}")
     
     # Exit with error code if validation failed
@@ -16,17 +16,24 @@ Example:
 """
 
 import argparse
+import math
 import sys
 import os
 import subprocess
 import random
+from functools import lru_cache
 from pathlib import Path
+import ijson
 import numpy as np
+import orjson
 import faiss
 
 # Import from build scripts
 sys.path.insert(0, str(Path(__file__).parent))
-from build_embeddings import Embedder, load_image_rgb
+from build_embeddings import Embedder, safe_filename
+from helpers import load_image_array
+
+IMAGE_EXTENSIONS = {"png", "jpg", "jpeg"}
 
 
 def get_active_conda_env() -> str | None:
@@ -37,10 +44,59 @@ def get_active_conda_env() -> str | None:
     return os.environ.get('CONDA_DEFAULT_ENV')
 
 
+def is_in_conda_env(env_name: str) -> bool:
+    """
+    Check if this interpreter already runs in the given conda environment.
+
+    Besides CONDA_DEFAULT_ENV, this recognizes the env's own python being
+    invoked directly (e.g. <conda root>/envs/<env_name>/bin/python) without
+    activating it first.
+    """
+    if get_active_conda_env() == env_name:
+        return True
+    prefix = Path(sys.prefix)
+    return prefix.name == env_name and prefix.parent.name == "envs"
+
+
+def _conda_env_prefixes(env_name: str) -> list:
+    """
+    Candidate install locations of a conda environment, found without running conda.
+
+    Looks under the envs/ directory of the conda installation (from
+    CONDA_ROOT, CONDA_PREFIX or CONDA_EXE) and in ~/.conda/environments.txt,
+    where conda records every env it creates, including ones outside envs/.
+    """
+    roots = []
+    if os.environ.get('CONDA_ROOT'):
+        roots.append(Path(os.environ['CONDA_ROOT']))
+    if os.environ.get('CONDA_PREFIX'):
+        prefix = Path(os.environ['CONDA_PREFIX'])
+        roots.append(prefix.parent.parent if prefix.parent.name == 'envs' else prefix)
+    if os.environ.get('CONDA_EXE'):
+        roots.append(Path(os.environ['CONDA_EXE']).parent.parent)  # <root>/bin/conda
+    candidates = [root / 'envs' / env_name for root in roots]
+
+    try:
+        with open(Path.home() / '.conda' / 'environments.txt', encoding='utf-8') as f:
+            for line in f:
+                prefix = Path(line.strip())
+                if prefix.name == env_name:
+                    candidates.append(prefix)
+    except OSError:
+        pass
+    return candidates
+
+
 def is_conda_env_available(env_name: str) -> bool:
     """
     Check if a conda environment exists.
+
+    Checks the likely env locations directly and only falls back to
+    `conda env list` when none of them holds the environment.
     """
+    for prefix in _conda_env_prefixes(env_name):
+        if (prefix / 'bin' / 'python').exists() or (prefix / 'python.exe').exists():
+            return True
     try:
         result = subprocess.run(
             ['conda', 'env', 'list', '--json'],
@@ -71,10 +127,8 @@ def run_in_conda_env(env_name: str, command: list) -> int:
     Returns:
         Exit code of the command
     """
-    current_env = get_active_conda_env()
-
     # Check if we're already in the right environment
-    if current_env == env_name:
+    if is_in_conda_env(env_name):
         print(f"✓ Already in conda environment '{env_name}'")
         return subprocess.run(command).returncode
 
@@ -103,7 +157,173 @@ def run_in_conda_env(env_name: str, command: list) -> int:
         return 1
 
 
-def test_perfect_match(image_path: Path, index_path: Path = None, meta_path: Path = None):
+# The model, index and metadata are loaded once per process, so repeated
+# test_perfect_match calls (e.g. from an interactive session) reuse them
+@lru_cache(maxsize=None)
+def _get_embedder(compile_model: bool = False) -> Embedder:
+    embedder = Embedder(compile_model=compile_model)
+    if compile_model:
+        # Trigger compilation here, so the query itself runs the compiled model
+        embedder.encode_images([np.zeros((256, 256, 3), dtype=np.uint8)])
+    return embedder
+
+
+@lru_cache(maxsize=None)
+def _get_index(index_path: Path) -> faiss.Index:
+    # FAISS only memory-maps IVF inverted lists: this keeps the lists of a
+    # --gpu-index (IVF-Flat) build on disk, while the default HNSW index is
+    # still read fully into memory
+    return faiss.read_index(str(index_path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+
+
+@lru_cache(maxsize=None)
+def _get_meta_shape(meta_path: Path) -> list:
+    # "shape" precedes "records" in meta.json, so the parse stops long before
+    # the record array
+    with open(meta_path, "rb") as f:
+        return next(ijson.items(f, "shape"))
+
+
+@lru_cache(maxsize=None)
+def _get_meta_offsets(jsonl_path: Path) -> np.ndarray:
+    """
+    Byte offset of every line of mtg_meta.jsonl (row i of the index is line i).
+
+    Read from the mtg_meta.offsets.npy the builder writes next to it; for
+    builds without one (or a JSONL file rewritten since), the offsets are
+    computed in memory with one vectorized newline scan.
+    """
+    size = jsonl_path.stat().st_size
+    try:
+        offsets = np.load(jsonl_path.with_suffix(".offsets.npy"), mmap_mode="r")
+        if len(offsets) and offsets[-1] < size and offsets.dtype == np.int64:
+            return offsets
+    except (OSError, ValueError):
+        pass
+    data = np.fromfile(jsonl_path, dtype=np.uint8)
+    ends = np.flatnonzero(data == ord("\n")) + 1
+    if size and data[-1] != ord("\n"):
+        ends = np.append(ends, size)  # last line has no trailing newline
+    return np.concatenate(([0], ends[:-1])).astype(np.int64)
+
+
+@lru_cache(maxsize=None)
+def _get_cache_rows(jsonl_path: Path) -> dict:
+    """
+    Map image_cache file stems (SHA-1 of the image URL) to index row ids.
+
+    Read from the mtg_meta.cache_rows.json the builder writes next to it; for
+    builds without one, derived in memory from the image_url on each line.
+    """
+    try:
+        return orjson.loads(jsonl_path.with_suffix(".cache_rows.json").read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        pass
+    rows = {}
+    with open(jsonl_path, "rb") as f:
+        for row, line in enumerate(f):
+            url = orjson.loads(line).get("image_url")
+            if url:
+                rows.setdefault(safe_filename(url).rpartition(".")[0], row)
+    return rows
+
+
+def _get_cache_row(meta_path: Path, image_path: Path) -> int | None:
+    """Index row built from a cached image, or None if it is not in the index."""
+    jsonl_path = meta_path.parent / "mtg_meta.jsonl"
+    if not jsonl_path.exists():
+        return None
+    return _get_cache_rows(jsonl_path).get(image_path.stem)
+
+
+def _stored_vector(index: faiss.Index, row: int) -> np.ndarray | None:
+    """Vector stored in the index for a row, or None if it cannot be reconstructed."""
+    try:
+        return index.reconstruct(row)
+    except RuntimeError:
+        pass
+    try:
+        # IVF indexes (--gpu-index) only reconstruct through an id -> list entry map
+        faiss.extract_index_ivf(index).make_direct_map()
+        return index.reconstruct(row)
+    except RuntimeError:
+        return None
+
+
+def _get_meta_records(meta_path: Path, ids) -> dict:
+    """
+    Return {row id: record} for the given row ids only.
+
+    Seeks straight to each record in the mtg_meta.jsonl next to meta.json
+    (one short read per id) when it is there and matches the index, and
+    otherwise streams meta.json's records array.
+    """
+    wanted = {int(i) for i in ids if i >= 0}
+    found = {}
+    if not wanted:
+        return found
+
+    jsonl_path = meta_path.parent / "mtg_meta.jsonl"
+    if jsonl_path.exists():
+        offsets = _get_meta_offsets(jsonl_path)
+        if len(offsets) == _get_meta_shape(meta_path)[0]:
+            with open(jsonl_path, "rb") as f:
+                for i in sorted(wanted):
+                    f.seek(int(offsets[i]))
+                    line = f.readline()
+                    # A line that does not end at the next offset means the
+                    # offsets no longer describe this file
+                    if i + 1 < len(offsets) and f.tell() != offsets[i + 1]:
+                        found.clear()
+                        break
+                    found[i] = orjson.loads(line)
+            if found:
+                return found
+
+    last = max(wanted)
+    with open(meta_path, "rb") as f:
+        for i, record in enumerate(ijson.items(f, "records.item", use_float=True)):
+            if i in wanted:
+                found[i] = record
+            if i >= last:
+                break
+    return found
+
+
+def _random_cached_image(cache_dir: Path) -> Path | None:
+    """
+    Pick a cached image uniformly at random in one directory pass.
+
+    Reservoir sampling over os.scandir, so no list of the (possibly
+    hundreds of thousands of) cache entries is ever built.
+    """
+    chosen, seen = None, 0
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if entry.name.rpartition(".")[2].lower() in IMAGE_EXTENSIONS and entry.is_file():
+                seen += 1
+                if random.randrange(seen) == 0:
+                    chosen = entry.path
+    return Path(chosen) if chosen is not None else None
+
+
+def _embed_image(image_path: Path, compile_model: bool = False) -> np.ndarray | None:
+    """Embed one image with the CLIP model; None (after printing why) on failure."""
+    print(f"🖼️  Generating embedding for test image...")
+    embedder = _get_embedder(compile_model)
+
+    # Load and pad on the CPU as a uint8 array; encode_images copies it to the
+    # model device as-is and resizes/normalizes it there
+    img = load_image_array(image_path, target_size=256)
+    if img is None:
+        print(f"❌ Failed to load image: {image_path}")
+        return None
+
+    return embedder.encode_image(img)
+
+
+def test_perfect_match(image_path: Path, index_path: Path = None, meta_path: Path = None, compile_model: bool = False,
+                       from_index: bool = False, verbose: bool = False):
     """
     Test that an image from the cache returns a perfect match when queried.
 
@@ -111,6 +331,11 @@ def test_perfect_match(image_path: Path, index_path: Path = None, meta_path: Pat
         image_path: Path to the test image
         index_path: Path to FAISS index (default: index_out/mtg_cards.faiss)
         meta_path: Path to metadata (default: index_out/meta.json)
+        compile_model: torch.compile the CLIP vision tower before querying
+        from_index: Query with the image's stored index vector instead of
+            running the model, if the image is in the index (checks the
+            index and scoring only, not embedding determinism)
+        verbose: Also print diagnostics such as the query embedding's norm
 
     Returns:
         bool: True if test passes (score >= 0.99), False otherwise
@@ -142,47 +367,52 @@ def test_perfect_match(image_path: Path, index_path: Path = None, meta_path: Pat
     print()
 
     # Load metadata
-    import json
-    with open(meta_path) as f:
-        meta_data = json.load(f)
+    shape = _get_meta_shape(meta_path)
 
     # Get embedding dimension from metadata
-    embedding_dim = meta_data['shape'][1]
+    embedding_dim = shape[1]
     print(f"📊 Embedding dimension: {embedding_dim}")
 
     # Load FAISS index
     print(f"📂 Loading FAISS index...")
-    index = faiss.read_index(str(index_path))
+    index = _get_index(index_path)
     print(f"   Index size: {index.ntotal} vectors")
     print()
 
-    # Generate embedding for test image
-    print(f"🖼️  Generating embedding for test image...")
-    embedder = Embedder()
-
-    # Load and preprocess image
-    img = load_image_rgb(image_path, target_size=256)
-    if img is None:
-        print(f"❌ Failed to load image: {image_path}")
-        return False
-
-    # Generate embedding
-    embedding = embedder.encode_images([img])
-    if embedding.shape[0] == 0:
-        print(f"❌ Failed to generate embedding")
-        return False
+    query_embedding = None
+    if from_index:
+        # Query with the vector stored for this image instead of re-embedding it
+        row = _get_cache_row(meta_path, image_path)
+        if row is None:
+            print(f"   ⚠️  {image_path.name} is not in the index metadata, running the model")
+        else:
+            query_embedding = _stored_vector(index, row)
+            if query_embedding is None:
+                print(f"   ⚠️  Index cannot reconstruct row {row}, running the model")
+            else:
+                print(f"📦 Using stored vector of index row {row} (model not run)...")
+    if query_embedding is None:
+        query_embedding = _embed_image(image_path, compile_model)
+        if query_embedding is None:
+            return False
 
-    query_embedding = embedding[0]
     print(f"   Embedding shape: {query_embedding.shape}")
-    print(f"   Embedding norm: {np.linalg.norm(query_embedding):.6f}")
+    if verbose:
+        print(f"   Embedding norm: {math.sqrt(float(query_embedding @ query_embedding)):.6f}")
     print()
 
-    # Query the index
+    # Query the index once for the top-5: the top-1 decides pass/fail and the
+    # rest is reused for the debug listing, so a failure needs no second search
     print(f"🔎 Querying index for top-1 match...")
-    distances, indices = index.search(query_embedding.reshape(1, -1), k=1)
+    # Private C-contiguous float32 buffer: FAISS reads it without converting,
+    # and normalizing in place leaves query_embedding untouched
+    q = np.empty((1, embedding_dim), dtype=np.float32)
+    np.copyto(q, query_embedding[None, :])
+    faiss.normalize_L2(q)  # inner product == cosine
+    distances_top5, indices_top5 = index.search(q, k=5)
 
-    score = distances[0][0]
-    matched_idx = indices[0][0]
+    score = distances_top5[0][0]
+    matched_idx = indices_top5[0][0]
 
     print(f"   Top match index: {matched_idx}")
     print(f"   Cosine similarity score: {score:.6f}")
@@ -196,8 +426,8 @@ def test_perfect_match(image_path: Path, index_path: Path = None, meta_path: Pat
         print(f"✅ PASS: Perfect match found! Score {score:.6f} >= {threshold}")
 
         # Print matched card info
-        if 'records' in meta_data:
-            matched_card = meta_data['records'][matched_idx]
+        matched_card = _get_meta_records(meta_path, [matched_idx]).get(int(matched_idx))
+        if matched_card is not None:
             print(f"   Matched card: {matched_card.get('name', 'Unknown')}")
             if 'set' in matched_card:
                 print(f"   Set: {matched_card['set']}")
@@ -209,11 +439,9 @@ def test_perfect_match(image_path: Path, index_path: Path = None, meta_path: Pat
 
         # Print top-5 matches for debugging
         print(f"\n   Top-5 matches:")
-        distances_top5, indices_top5 = index.search(query_embedding.reshape(1, -1), k=5)
+        top5_records = _get_meta_records(meta_path, indices_top5[0])
         for i, (dist, idx) in enumerate(zip(distances_top5[0], indices_top5[0])):
-            card_name = "Unknown"
-            if 'records' in meta_data and idx < len(meta_data['records']):
-                card_name = meta_data['records'][idx].get('name', 'Unknown')
+            card_name = top5_records.get(int(idx), {}).get('name', 'Unknown')
             print(f"   {i+1}. {card_name} (score: {dist:.6f})")
 
         return False
@@ -241,6 +469,23 @@ def main():
         default=None,
         help="Path to metadata (default: index_out/meta.json)"
     )
+    parser.add_argument(
+        "--compile",
+        dest="compile_model",
+        action="store_true",
+        default=os.environ.get("EMBEDDER_COMPILE") == "1",
+        help="torch.compile the CLIP vision tower (slower startup; default: on if EMBEDDER_COMPILE=1)"
+    )
+    parser.add_argument(
+        "--from-index",
+        action="store_true",
+        help="Query with the image's stored index vector instead of running the model (checks the index and scoring only)"
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Print extra diagnostics (query embedding norm)"
+    )
     parser.add_argument(
         "--conda-env",
         type=str,
@@ -256,7 +501,7 @@ def main():
     args = parser.parse_args()
 
     # If not skipping conda and not already in the environment, re-run in conda
-    if not args.skip_conda and get_active_conda_env() != args.conda_env:
+    if not args.skip_conda and not is_in_conda_env(args.conda_env):
         print(f"🐍 Running test in conda environment '{args.conda_env}'...\n")
         # Reconstruct command with same arguments
         cmd = [sys.executable, __file__] + sys.argv[1:] + ['--skip-conda']
@@ -271,21 +516,22 @@ def main():
             return 1
 
         # Get random image from cache
-        images = []
-        for ext in ("*.png", "*.jpg", "*.jpeg"):
-            images.extend(cache_dir.glob(ext))
-        if not images:
+        image_path = _random_cached_image(cache_dir)
+        if image_path is None:
             print(f"❌ No images found in cache: {cache_dir}")
             return 1
 
-        args.image_path = random.choice(images)
+        args.image_path = image_path
         print(f"📸 Using random cached image: {args.image_path.name}\n")
 
     # Run test
     success = test_perfect_match(
         args.image_path,
         args.index_path,
-        args.meta_path
+        args.meta_path,
+        args.compile_model,
+        args.from_index,
+        args.verbose
     )
 
     return 0 if success else 1